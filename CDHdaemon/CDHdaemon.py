@@ -1,6 +1,5 @@
 #!/bin/python3
 
-import smbus2
 import time
 import threading
 import queue
@@ -9,14 +8,55 @@ import socket
 import ctypes
 import os
 import signal
+import datetime
+import functools
+
+#the CDH_* environment variables allow running the daemon without
+#flight hardware (see simADCS.py), they are not set by CDH.service
+if os.environ.get("CDH_FAKE_SMBUS"):
+	import fakeSMBus as smbus2
+else:
+	import smbus2
+
+#saving daemon start time to measure startup latency
+startTime=time.monotonic()
 
 #set stdout in line buffering mode
 sys.stdout.reconfigure(line_buffering=True)
 
+#Diagnostic logging -------------------
+import diagLog
+diagLevel=os.environ.get("CDH_LOG_LEVEL","INFO") #DEBUG, INFO, WARNING or ERROR
+diagRateBurst=5 #messages of the same kind written in a period, the following ones are only counted
+diagRatePeriod=60 #rate limiting period (s), then a summary of the suppressed messages is written
+diagLog.configure(getattr(diagLog,diagLevel.upper(),diagLog.INFO),diagRateBurst,diagRatePeriod)
+diagLog.start() #messages are written on stdout by a background thread
+#--------------------------------------
+
+#Messages schema ----------------------
+schemaPath="./messages/messages.json" #schema loaded at startup and on "reload schema"
+schemaReloadLock=threading.Lock() #lock to avoid concurrent schema reloads
+daemonStats={} #daemon statistics, readable from client with "stats"
+#--------------------------------------
+
 sys.path.append("./messages")
-import messages as msg
+import schemaLoader
+import deadband
+import latency
+import supervisor
+import influxWriter
+import scheduler
+import memStats
+import lossTracker
+import boardSim
+import lineProtocol
+msg,schemaInfo=schemaLoader.loadSchema(schemaPath)
+diagLog.info("Loaded schema {0} from {1} in {2:.1f} ms",schemaInfo["hash"],"cache" if schemaInfo["cached"] else schemaPath,schemaInfo["loadTime"])
+daemonStats["schemaHash"]=schemaInfo["hash"]
+daemonStats["schemaLoadTimeMs"]=round(schemaInfo["loadTime"],3)
+
 serial = ctypes.CDLL("./serial/serialInterface.so")
-print("Maximum serial payload length: {0}\n".format(serial.getMaxLen()))
+diagLog.info("Maximum serial payload length: {0}",serial.getMaxLen())
 
 #ADC thread ---------------------------
 address=0x48
@@ -27,22 +67,53 @@ ADCperiod=5 #sampling period in seconds
 #--------------------------------------
 
 #Client thread ------------------------
-cdhSockPath="/tmp/CDH.sock"
+cdhSockPath=os.environ.get("CDH_SOCK","/tmp/CDH.sock")
 clientQueueTx=queue.Queue() #queue to send data to client
 clientQueueTxTimeout=0.1 #timeout for reading from client tx queue
-clientQueueRx=queue.Queue() #queue to receive data from client
 uartTimeout=0.100 # timeout for uart transmission with ack
 uartRetries=2 #number of retries in case of failed ack (total 3 tries)
 #--------------------------------------
 
 #CDH thread ---------------------------
-availableCommands=[0,1] #command codes available from client
-clientQueueRxTimeout=0.02 #timeout for reaing from client rx queue
+lineQueueTimeout=0.02 #timeout for reading from the line command queues
+#transport of the ADCS line: uart, pty (the daemon creates it and links its
+#slave to CDH_UART_DEV for a simulator), mem or socket (in-process memory
+#pipe or socket pair with the board simulated by the daemon, see boardSim.py)
+uartTransport=os.environ.get("CDH_TRANSPORT","uart")
+uartDev=os.environ.get("CDH_UART_DEV","/tmp/ADCS.pty" if uartTransport=="pty" else "/dev/serial0") #UART device towards ADCS
+uartBaud=115200 #default baud rate of the serial lines
+#serial lines, each one is read by its own CDH thread and carries the
+#message codes declared for it in the lines section of messages.json,
+#the line name is used as source tag of its telemetry
+serialLines={
+	"ADCS":{"transport":uartTransport,"dev":uartDev,"baud":uartBaud,"timeout":uartTimeout,"retries":uartRetries}
+}
+#more lines can be added with CDH_LINES="name=device[:baud],..." (e.g. for testing),
+#with mem or socket as device the line gets a simulated board
+for lineSpec in os.environ.get("CDH_LINES","").split(","):
+	if lineSpec:
+		lineName,lineDev=lineSpec.split("=",1)
+		lineDev,_,lineBaud=lineDev.partition(":")
+		lineTransport=lineDev if lineDev in ["mem","socket"] else "uart"
+		serialLines[lineName]={"transport":lineTransport,"dev":lineDev,"baud":int(lineBaud or uartBaud),"timeout":uartTimeout,"retries":uartRetries}
+#frames per second of the simulated boards, CDH_SIM_RATES="message=rate,..."
+simRates={name:float(rate) for name,_,rate in (spec.partition("=") for spec in os.environ.get("CDH_SIM_RATES","").split(",") if spec)}
+boardSims={} #line index -> simulated board on its other end (mem and socket transports)
+lineQueues={name:queue.Queue() for name in serialLines} #messages from client to be sent on each line
+enableDeadband=os.environ.get("CDH_DEADBAND","1")!="0" #send telemetry fields only when they change (thresholds in messages.json)
+deadbandHeartbeat=60 #default time (s) after which an unchanged field is sent anyway
+deadbandFilter=deadband.DeadbandFilter(deadbandHeartbeat)
+schedPath=os.environ.get("CDH_SCHED_FILE","scheduledCommands.json") #time-tagged commands queue file
+schedMaxLate=60 #scheduled commands late more than this (s) are discarded (e.g. daemon was down)
+sched=scheduler.CommandScheduler(schedPath,schedMaxLate)
+enqueueLatency=latency.LatencyHistogram("rxToEnqueue") #frame arrival -> log queue
+memReportTop=10 #default number of allocation sites listed by "mem"
+eventsDefault=20 #default number of diagnostic events listed by "events"
 #--------------------------------------
 
 #Logging thread -----------------------
-telegrafSockPath="/tmp/telegraf.sock" #telegraf socket path
-logQueue=queue.Queue() #queue to send strings for telegraf/log file
+telegrafSockPath=os.environ.get("CDH_TELEGRAF_SOCK","/tmp/telegraf.sock") #telegraf socket path
+logQueue=queue.Queue() #queue to send strings or telemetryFrame records for telegraf/log file
 logQueueTimeout=0.05 #timeout for log queue read (to reduce CPU starving)
 telegrafRetryTime=3 #time waited after telegraf connection failure before retrying
 enableFileLog=False #file logging enabled/disabled
@@ -52,11 +123,41 @@ fileBuffering=512 #file buffer size (see python file buffering modes for details
 		#ADCS is expected, in case of service interruption this amount
 		#of data can be lost
 fileRetryTime=3 #time waited after log file opening failure before retrying
+sendLatency=latency.LatencyHistogram("rxToSend") #frame arrival -> sent to telegraf
+telemetrySink=os.environ.get("CDH_SINK","telegraf") #"telegraf" (unixgram socket) or "influx" (direct HTTP writes)
+influxUrl=os.environ.get("INFLUX_URL","http://localhost:8086") #same variables used by telegraf
+influxToken=os.environ.get("INFLUX_TOKEN","")
+influxOrg="starlab"
+influxBucket="dlab"
+influxBatchLines=5000 #maximum lines in a single write request
+influxBatchTime=1 #maximum time (s) a line waits in a batch
+influxBufferLines=100000 #maximum lines buffered while InfluxDB is not reachable
+influxTimeout=2 #HTTP timeout (s), kept below the heartbeat timeout of the log thread
+influxSink=None #InfluxDB writer, kept outside the log thread to not lose its buffer on restarts
+lineSeq=os.environ.get("CDH_LINE_SEQ","0")!="0" #add the cdhSeq sequence field to every line (see telegraf/verifyLoss.py)
+lineSeqField="cdhSeq" #name of the sequence field
+lossTickField="ticktime" #tick counter field used to detect frames missing at the source
+loss=lossTracker.LossTracker(lossTickField) #kept outside the log thread to not lose its counters on restarts
+lineArrayKeys=os.environ.get("CDH_ARRAY_KEYS","bracket") #array element field keys: bracket (temperature[0]), underscore (temperature_0) or dot (temperature.0)
+lineIntFields=os.environ.get("CDH_INT_FIELDS","1")!="0" #write integer fields as integers ("i" suffix), 0 writes them as floats (buckets where they were created as floats)
+lineEncoder=lineProtocol.LineEncoder(lineArrayKeys,lineIntFields) #float precision is set per field in messages.json
+if telemetrySink=="influx":
+	influxSink=influxWriter.InfluxWriter(influxUrl,influxToken,influxOrg,influxBucket,batchLines=influxBatchLines,batchTime=influxBatchTime,maxBufferLines=influxBufferLines,timeout=influxTimeout)
 #--------------------------------------
 
+statsPeriod=60 #period (s) of daemon statistics sending to telegraf
 stopThreads=threading.Event() #thread safe flag to signal to all threads to stop
 threadTermTimeout=3 #timeout for thread join() after termination
 
+#Supervisor ---------------------------
+restartBackoffMin=0.01 #delay before restarting a failed subsystem (s), doubled at every consecutive failure
+restartBackoffMax=30 #maximum delay before restarting a failed subsystem (s)
+restartStableTime=60 #running time (s) after which a subsystem failures count is reset
+heartbeatTimeout=5 #time (s) without heartbeats after which a subsystem is considered hung
+adcHeartbeatTimeout=3*ADCperiod #the ADC thread sends a heartbeat every ADCperiod
+sv=supervisor.Supervisor(stopThreads,restartBackoffMin,restartBackoffMax,restartStableTime)
+#--------------------------------------
+
 #setting up the ADC
 def setupADC(printerr=True):
 	try:
@@ -64,7 +165,7 @@ def setupADC(printerr=True):
 		bus.write_byte(address, command)
 	except:
 		if printerr:
-			print("ERROR: Failed to set up ADC")
+			diagLog.error("Failed to set up ADC")
 		
 	#waiting to stabilize Vref
 	time.sleep(0.005)
@@ -79,26 +180,26 @@ def readADC(printerr=True):
 			convres[ch]=convOut[0]*256+convOut[1]
 	except:
 		if printerr:
-			print("ERROR: Failed to read the ADC, trying to set it up again")
+			diagLog.error("Failed to read the ADC, trying to set it up again")
 		setupADC(printerr)
 		
 	return convres
 	
-def adcThread():
-	print("ADC thread started")
+def adcThread(wk):
+	diagLog.info("ADC thread started")
 	
 	global logQueue
 	global address
 	global command
 	global bus
 	global ADCperiod
-	global stopThreads
 	
-	print("Setting up ADC")
+	diagLog.info("Setting up ADC")
 	setupADC()
 	while 1: #thread loop
-		if stopThreads.is_set(): #need to close thread
+		if wk.stopping(): #need to close thread
 			break
+		wk.beat()
 		#lightweight method to get periodic task without strict control on period overflow or system time changes
 		time.sleep(ADCperiod-time.time()%ADCperiod)		
 		#getting ADC data
@@ -121,18 +222,16 @@ def adcThread():
 		#sending data to logThread
 		logQueue.put(finalString)
 
-def clientThread():
-	print("Client thread started")
+def clientThread(wk):
+	diagLog.info("Client thread started")
 	
 	global cdhSockPath
 	global clientQueueTx
-	global clientQueueRx
-	global stopThreads
 	global clientQueueTxTimeout
 	
 	server=None
 	#creating socket for client
-	print("Creating client socket")
+	diagLog.info("Creating client socket")
 	try:
 		if os.path.exists(cdhSockPath):
 			os.remove(cdhSockPath)
@@ -141,13 +240,14 @@ def clientThread():
 		server.bind(cdhSockPath)
 		server.setblocking(False)
 	except:
-		print("ERROR: Failed to create client socket {0}".format(cdhSockPath))
+		diagLog.error("Failed to create client socket {0}",cdhSockPath)
 	
 	addr=None
 	
 	while 1:
-		if stopThreads.is_set(): #need to close thread
+		if wk.stopping(): #need to close thread
 			break
+		wk.beat()
 			
 		#try receiving data from client socket
 		try:
@@ -155,7 +255,7 @@ def clientThread():
 		except BlockingIOError:
 			pass #if timeout reached don't do anything
 		except: #other exceptions
-			print("ERROR: Failed to read from client socket, trying to recreate socket")
+			diagLog.error("Failed to read from client socket, trying to recreate socket")
 			try:
 				if os.path.exists(cdhSockPath):
 					os.remove(cdhSockPath)
@@ -164,9 +264,9 @@ def clientThread():
 				server.bind(cdhSockPath)
 				server.setblocking(False)
 			except:
-				print("ERROR: Failed to create client socket {0}".format(cdhSockPath))
+				diagLog.error("Failed to create client socket {0}",cdhSockPath)
 		else:
-			clientQueueRx.put(datain.decode("utf-8"))
+			handleCommand(datain.decode("utf-8"))
 			
 		#see if there's some output for client
 		try:
@@ -179,7 +279,7 @@ def clientThread():
 			except: #in case client was closed or other errors, just ignore the output
 				pass
 
-	print("Closing and deleting client socket")
+	diagLog.info("Closing and deleting client socket")
 	try:
 		server.close()
 	except:
@@ -190,8 +290,8 @@ def clientThread():
 	except:
 		pass	
 		
-def logThread():
-	print("Log thread started")
+def logThread(wk):
+	diagLog.info("Log thread started")
 	
 	global telegrafSockPath
 	global logQueue
@@ -201,7 +301,6 @@ def logThread():
 	global enableFileLog
 	global fileBuffering
 	global fileRetryTime
-	global stopThreads
 	
 	telegrafTryTime=0
 	socketState=0
@@ -211,22 +310,24 @@ def logThread():
 	
 	telegrafSock=None
 	logFile=None
+	lastSchema=None #module of the schema of the last frame, used to reset the deadband state on schema reload
 	
 	while 1: #thread loop
-		if stopThreads.is_set(): #need to close thread
+		if wk.stopping(): #need to close thread
 			break
+		wk.beat()
 		
 		#checking if telegraf is not connected
-		if socketState==0 and (time.time()-telegrafTryTime)>telegrafRetryTime:
+		if not influxSink and socketState==0 and (time.time()-telegrafTryTime)>telegrafRetryTime:
 			telegrafTryTime=time.time()
 			telegrafSock=socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
 			try:
 				telegrafSock.connect(telegrafSockPath)
 			except:
-				print("ERROR: Failed to connect to telegraf ({0}), retrying in {1} seconds".format(telegrafSockPath,telegrafRetryTime))
+				diagLog.error("Failed to connect to telegraf ({0}), retrying in {1} seconds",telegrafSockPath,telegrafRetryTime)
 			else:
 				socketState=1
-				print("telegraf socket ({0}) connected".format(telegrafSockPath))	
+				diagLog.info("telegraf socket ({0}) connected",telegrafSockPath)
 		
 		#checking if log file is not opened
 		if enableFileLog and fileState==0 and (time.time()-fileTryTime)>fileRetryTime:
@@ -234,202 +335,545 @@ def logThread():
 			try:
 				logFile=open(logFilePath,"w",fileBuffering) #opening log file
 			except:
-				print("ERROR: Failed to open log file ({0}), retrying in {1} seconds".format(logFilePath,fileRetryTime))
+				diagLog.error("Failed to open log file ({0}), retrying in {1} seconds",logFilePath,fileRetryTime)
 			else:
 				fileState=1
-				print("log file ({0}) opened".format(logFilePath))
+				diagLog.info("log file ({0}) opened",logFilePath)
 				
 		
 		#checking if there's some data to be logged
+		#(queue items are ready lines or telemetryFrame records still to be decoded)
 		try:
-			log=logQueue.get(timeout=logQueueTimeout)
+			item=logQueue.get(timeout=logQueueTimeout)
 		except:
-			pass
+			item=None
+		if isinstance(item,telemetryFrame):
+			#resetting the deadband state and the encoding plans when frames of a new schema arrive
+			if item.msgClass.__module__!=lastSchema:
+				if lastSchema is not None:
+					deadbandFilter.reset()
+					lineEncoder.reset()
+				lastSchema=item.msgClass.__module__
+			log=formatFrame(item)
+			arrival=item.rxMono
 		else:
-			#if some data has been received, encode it
+			log=item
+			arrival=None
+		if log: #something to send (not suppressed by the deadband)
+			#numbering the line (appending the sequence field after the other fields)
+			seq=loss.nextSeq()
+			if lineSeq:
+				split=log.rindex(" ")
+				log="{0},{1}={2}i{3}".format(log[:split],lineSeqField,seq,log[split:])
+			#encoding it
 			logbyte=log.encode("utf-8")
-			#send it to telegraf
-			if socketState==1:
+			#add it to the InfluxDB batch or send it to telegraf
+			if influxSink:
+				influxSink.write(logbyte,arrival)
+			elif socketState==1:
 				try:
 					telegrafSock.send(logbyte)
+					if arrival:
+						sendLatency.add(time.monotonic_ns()-arrival)
 				except:
-					print("ERROR: Failed to send data to telegraf")
+					diagLog.error("Failed to send data to telegraf")
+					loss.dropped()
 					telegrafSock.close()
 					socketState=0
+			else: #telegraf not connected
+				loss.dropped()
 					
 			if enableFileLog and fileState==1:
 				try:
 					logFile.write(log)
 				except:
-					print("ERROR: Failed to write data on file")
+					diagLog.error("Failed to write data on file")
 					logFile.close()
 					fileState=0
+		
+		#sending InfluxDB batches which are ready
+		if influxSink:
+			for arrival in influxSink.poll():
+				if arrival:
+					sendLatency.add(time.monotonic_ns()-arrival)
 				
-	print("Closing telegraf socket")
-	telegrafSock.close()
+	#(only when the daemon is closing, a restarted log thread keeps using the writer)
+	if influxSink and stopThreads.is_set():
+		diagLog.info("Flushing InfluxDB writer")
+		influxSink.flush()
+		influxSink.close()
+	
+	diagLog.info("Closing telegraf socket")
+	if telegrafSock:
+		telegrafSock.close()
 	
-	if enableFileLog:
-		print("Closing log file")
+	if enableFileLog and logFile:
+		diagLog.info("Closing log file")
 		logFile.close()
 		
-def cdhThread():
-	print("CDH thread started")
+#received telemetry frame waiting in the log queue: only the raw frame
+#and its arrival times are kept, the frame is decoded and formatted by
+#the log thread (so no Structure, list or string is built per frame on
+#the UART path, and queued frames take little memory)
+class telemetryFrame:
+	__slots__=("msgClass","source","data","rxMono","rxReal")
+
+	def __init__(self,msgClass,source,data,rxMono,rxReal):
+		self.msgClass=msgClass
+		self.source=source
+		self.data=data #raw frame (bytes)
+		self.rxMono=rxMono #arrival time (CLOCK_MONOTONIC ns)
+		self.rxReal=rxReal #arrival time (CLOCK_REALTIME ns), used as timestamp
+
+#decodes a telemetry frame and returns its influxdb line (None if all its
+#fields are suppressed by the deadband or are not finite)
+def formatFrame(frame):
+	msgClass=frame.msgClass
+	#flat tuple of all fields (array elements become single fields)
+	values=msgClass.unpacker.unpack(frame.data)
+	keys=lineEncoder.plan(msgClass).keys
+
+	#checking for frames missing before this one
+	missing=loss.frame(msgClass,frame.source,values,keys)
+	if missing:
+		diagLog.warning("{0} {1} frames missing from {2} before tick {3}",missing,msgClass.__name__,frame.source,values[loss.tickIndex[msgClass]])
+
+	#selecting the fields that changed more than their deadband
+	if enableDeadband:
+		emit=deadbandFilter.filter(msgClass,frame.source,values,frame.rxMono/1e9)
+		if not emit: #the whole line was suppressed
+			return None
+	else:
+		emit=range(len(values))
+
+	#building influxdb write string: message name as dataset name, source tag,
+	#selected fields (typed as in the schema) and arrival time as timestamp
+	return lineEncoder.line(msgClass,",source="+frame.source,values,emit,frame.rxReal)
+
+#returns all daemon statistics in a single dictionary
+def collectStats():
+	stats=dict(daemonStats)
+	stats.update(memStats.processMemory())
+	stats.update(deadbandFilter.stats())
+	stats.update(enqueueLatency.stats())
+	stats.update(sendLatency.stats())
+	stats.update(sv.stats())
+	stats.update(sched.stats())
+	stats.update(loss.stats())
+	stats.update(lineEncoder.stats())
+	stats.update(diagLog.stats())
+	for sim in list(boardSims.values()):
+		for key,value in sim.stats().items():
+			stats[key]=stats.get(key,0)+value
+	if influxSink:
+		stats.update(influxSink.stats())
+	return stats
+
+#builds the influxdb line with the numeric daemon statistics
+def statsLine():
+	fields=["{0}={1}".format(key,value) for key,value in collectStats().items() if isinstance(value,(int,float))]
+	return "statsCDH,source=CDH {0} {1}\n".format(",".join(fields),time.time_ns())
+
+#validates a command string from client and returns the packed
+#message, raises an exception if the command is not valid
+def packCommand(schema,data):
+	#extract message struct from command string
+	msgStruct=schema.parseStruct(data)
+	if msgStruct.direction!="command": #only commands can be sent to boards
+		raise Exception
+	return bytes(msgStruct)
+
+#returns the time (CLOCK_REALTIME ns) of an "at" command, the time can be
+#given as unix time in seconds or in ISO 8601 format (local time if no
+#timezone is given), raises ValueError if the time is not valid
+def parseAtTime(timestr):
+	try:
+		return int(float(timestr)*1e9)
+	except (ValueError,OverflowError):
+		pass
+	try:
+		return int(datetime.datetime.fromisoformat(timestr).timestamp()*1e9)
+	except (ValueError,OverflowError):
+		raise ValueError("'{0}' is not a unix time or an ISO 8601 time".format(timestr))
+
+#returns the time (CLOCK_REALTIME ns) of an "in" command, raises
+#ValueError if the delay is not valid
+def parseInTime(timestr):
+	try:
+		delay=float(timestr)
+		if not delay>=0:
+			raise ValueError
+		return time.time_ns()+int(delay*1e9)
+	except (ValueError,OverflowError):
+		raise ValueError("'{0}' is not a valid delay (seconds, not negative)".format(timestr))
+
+#reloads the messages schema and swaps it with the one in use,
+#the cdh thread takes a reference to msg at every loop, so rebinding
+#the global name is enough to switch schema between two frames
+def reloadSchemaThread():
+	global msg
+	global schemaPath
+	global clientQueueTx
+	global daemonStats
+
+	if not schemaReloadLock.acquire(blocking=False):
+		clientQueueTx.put("ERROR: a schema reload is already in progress\n")
+		return
+
+	try:
+		newmsg,info=schemaLoader.loadSchema(schemaPath)
+	except Exception as e:
+		diagLog.error("Failed to reload schema ({0})",e)
+		clientQueueTx.put("ERROR: failed to reload schema ({0}), keeping the current one\n".format(e))
+	else:
+		msg=newmsg
+		daemonStats["schemaHash"]=info["hash"]
+		daemonStats["schemaLoadTimeMs"]=round(info["loadTime"],3)
+		diagLog.info("Reloaded schema {0} in {1:.1f} ms",info["hash"],info["loadTime"])
+		clientQueueTx.put("Schema {0} loaded in {1:.1f} ms\n".format(info["hash"],info["loadTime"]))
+	finally:
+		schemaReloadLock.release()
+
+#builds the "mem" report (taking a tracemalloc snapshot can be slow, so
+#it runs in its own thread like the schema reload)
+def memReportThread(top):
+	queues={
+		"logQueue":memStats.queueUsage(logQueue),
+		"clientQueueTx":memStats.queueUsage(clientQueueTx),
+		"scheduledCommands":(len(sched.heap),None),
+		"deadbandSeries":(len(deadbandFilter.series),None)
+	}
+	for name in lineQueues:
+		queues["lineQueue"+name]=memStats.queueUsage(lineQueues[name])
+	if influxSink:
+		queues["influxBufferedLines"]=(influxSink.pendingLines+len(influxSink.lines),None)
+	try:
+		clientQueueTx.put(memTracer.report(queues,top))
+	except Exception as e:
+		clientQueueTx.put("ERROR: failed to build memory report ({0})\n".format(e))
+
+#returns the name of the serial line carrying a message code (None if
+#no configured line carries it), every code goes to the first line if
+#the schema doesn't declare lines
+def routeCode(schema,code):
+	if not schema.lineDict:
+		return next(iter(serialLines))
+	line=schema.lineOf(code)
+	return line if line in serialLines else None
+
+#checks that a message code can arrive on the serial line lineName (any
+#code can arrive on any line if the schema doesn't declare lines)
+def lineCarries(schema,code,lineName):
+	return not schema.lineDict or schema.lineOf(code)==lineName
+
+#handles a command string received from client, daemon commands are
+#answered here, messages are queued for the thread of their serial line
+def handleCommand(data):
+	global clientQueueTx
+	global lineQueues
+
+	#taking the schema for the whole command (it can be swapped by a reload)
+	schema=msg
+
+	if not data.split():
+		clientQueueTx.put("ERROR: empty command, you can list available commands with 'help'\n")
+
+	elif data.split()==["reload","schema"]:
+		#loading in a separate thread to keep serving the client
+		threading.Thread(target=reloadSchemaThread, daemon=True).start()
+
+	elif data.split(maxsplit=1)[0]=="stats":
+		statstring=""
+		for key,value in collectStats().items():
+			statstring+="{0}: {1}\n".format(key,value)
+		clientQueueTx.put(statstring)
+
+	elif data.split(maxsplit=1)[0]=="latency":
+		clientQueueTx.put(str(enqueueLatency)+str(sendLatency))
+
+	elif data.split(maxsplit=1)[0] in ["at","in"]:
+		#time-tagged command: "at <time> <command>" or "in <seconds> <command>"
+		error=None
+		try:
+			kind,timestr,cmd=data.split(maxsplit=2)
+		except ValueError:
+			error="the time or the command is missing"
+		else:
+			try:
+				due=parseAtTime(timestr) if kind=="at" else parseInTime(timestr)
+			except ValueError as e:
+				error=str(e)
+			else:
+				#commands this late would be discarded as expired when due
+				late=(time.time_ns()-due)/1e9
+				if late>schedMaxLate:
+					error="the time is {0:.3f} s in the past, at most {1} s are accepted".format(late,schedMaxLate)
+				else:
+					try:
+						payload=packCommand(schema,cmd)
+						if routeCode(schema,payload[0]) is None:
+							raise Exception
+					except:
+						error="the scheduled command was not recognized or its arguments format is wrong"
+		if error:
+			clientQueueTx.put("ERROR: {0}\nUse 'at <unix time or ISO 8601 time> <command>' or 'in <seconds> <command>'\n".format(error))
+		else:
+			cid=sched.add(due,payload,cmd.strip())
+			clientQueueTx.put("{0} scheduled with id {1} in {2:.3f} s\n".format(cmd.split(maxsplit=1)[0],cid,(due-time.time_ns())/1e9))
+
+	elif data.split(maxsplit=1)[0]=="mem":
+		#"mem [n]" report, "mem start"/"mem stop" switch allocation tracing
+		arg=data.split()[1] if len(data.split())>1 else ""
+		if arg=="start":
+			if not memTracer.tracing():
+				memTracer.start()
+			clientQueueTx.put("Allocation tracing started\n")
+		elif arg=="stop":
+			if memTracer.tracing():
+				memTracer.stop()
+			clientQueueTx.put("Allocation tracing stopped\n")
+		else:
+			try:
+				top=int(arg) if arg else memReportTop
+			except:
+				clientQueueTx.put("ERROR: use 'mem [number of sites]', 'mem start' or 'mem stop'\n")
+			else:
+				threading.Thread(target=memReportThread,args=(top,),daemon=True).start()
+
+	elif data.split(maxsplit=1)[0]=="events":
+		#"events [n]" lists the last n diagnostic messages
+		try:
+			n=int(data.split()[1]) if len(data.split())>1 else eventsDefault
+		except:
+			clientQueueTx.put("ERROR: use 'events [number of events]'\n")
+		else:
+			clientQueueTx.put(diagLog.recent(n))
+
+	elif data.split(maxsplit=1)[0]=="loss":
+		lossstring=loss.listing()
+		for key,value in loss.stats().items():
+			lossstring+="{0}: {1}\n".format(key,value)
+		clientQueueTx.put(lossstring)
+
+	elif data.split(maxsplit=1)[0]=="queue":
+		clientQueueTx.put(sched.listing()+str(sched.jitter))
+
+	elif data.split(maxsplit=1)[0]=="cancel":
+		try:
+			cid=int(data.split()[1])
+		except:
+			clientQueueTx.put("ERROR: use 'cancel <id>' (ids are listed by 'queue')\n")
+		else:
+			if sched.cancel(cid):
+				clientQueueTx.put("Scheduled command {0} cancelled\n".format(cid))
+			else:
+				clientQueueTx.put("ERROR: no scheduled command with id {0}\n".format(cid))
+
+	elif data.split(maxsplit=1)[0]=="help":
+		helpstring='Available commands (array elements should be passed inside quotes " "):\n'
+		for available in [code for code in schema.msgDict if schema.msgDict[code].direction=="command" and routeCode(schema,code) is not None]:
+			try:
+				helpstring+="{0}\n\n".format(schema.msgDict[available]())
+			except:
+				pass
+		helpstring+="Daemon commands:\nreload schema\nstats\nlatency\nloss\nevents [number of events]\nmem [number of sites]\nmem start\nmem stop\n"
+		helpstring+="at <unix time or ISO 8601 time> <command>\nin <seconds> <command>\nqueue\ncancel <id>\n"
+			
+		clientQueueTx.put(helpstring)
+
+	else:
+		#Here we handle all the possible commands from client
+		try:
+			bufftx=packCommand(schema,data)
+		except:
+			clientQueueTx.put("ERROR: the requested command was not recognized or the arguments format is wrong\nYou can list avilable commands with 'help'\n")
+		else:
+			#queueing the message for the thread of its serial line
+			line=routeCode(schema,bufftx[0])
+			if line is None:
+				clientQueueTx.put("ERROR: no serial line carries {0}\n".format(data.split(maxsplit=1)[0]))
+			else:
+				lineQueues[line].put((bufftx,data.split(maxsplit=1)[0]))
+
+#opens a serial line on its transport, returns the line index (negative on
+#failure), with the mem and socket transports also starts the simulated
+#board on the other end of the line
+def openSerialLine(lineName,settings):
+	timeout=ctypes.c_float(settings["timeout"])
+	retries=ctypes.c_uint8(settings["retries"])
+	match settings["transport"]:
+		case "uart":
+			return serial.openLine(settings["dev"].encode("utf-8"),settings["baud"],timeout,retries)
+		case "pty":
+			return serial.openLinePty(settings["dev"].encode("utf-8"),timeout,retries)
+		case "mem" | "socket":
+			peer=ctypes.c_int(-1)
+			line=serial.openLinePair(0 if settings["transport"]=="mem" else 1,timeout,retries,ctypes.byref(peer))
+			if line>=0:
+				sim=boardSim.BoardSimulator(serial,peer.value,msg,simRates)
+				sim.start("sim"+lineName)
+				boardSims[line]=sim #by index: a retired thread of the same line closes only its own simulator
+			return line
+		case _:
+			diagLog.error("Unknown transport {0} for line {1}",settings["transport"],lineName)
+			return -1
+
+#closes a serial line opened by openSerialLine
+def closeSerialLine(line):
+	sim=boardSims.pop(line,None)
+	if sim:
+		sim.stop.set()
+		sim.thread.join(1)
+		serial.closeLine(sim.line)
+	serial.closeLine(line)
+
+def cdhThread(wk,lineName):
+	diagLog.info("CDH thread of line {0} started",lineName)
 	
 	global logQueue
 	global clientQueueTx
-	global clientQueueRx
-	global stopThreads
-	global clientQueueRxTimeout
-	global uartTimeout
-	global uartRetries
+	global lineQueues
+	global lineQueueTimeout
+	global serialLines
+	global daemonStats
+	global enqueueLatency
+
+	settings=serialLines[lineName]
+	lineQueue=lineQueues[lineName]
 
-	#initializing serial line towards ADCS
-	print("Initializing UART")
-	serial.initUART(ctypes.c_float(uartTimeout),ctypes.c_uint8(uartRetries))
+	rxIdle=True #false while frames are arriving back to back
+	rxMono=ctypes.c_uint64(0) #arrival time of the last frame (CLOCK_MONOTONIC ns)
+	rxReal=ctypes.c_uint64(0) #arrival time of the last frame (CLOCK_REALTIME ns)
+	buffrx=ctypes.create_string_buffer(serial.getMaxLen()) #receive buffer, reused for every frame
+
+	#the commands scheduled for this line
+	def ownCommand(entry):
+		return routeCode(msg,entry[2][0])==lineName
+
+	#initializing serial line
+	diagLog.info("Initializing line {0} ({1} {2})",lineName,settings["transport"],settings["dev"])
+	line=openSerialLine(lineName,settings)
+	if line<0: #the supervisor will try again
+		raise Exception("failed to open line {0} ({1} {2})".format(lineName,settings["transport"],settings["dev"]))
 	
-	while 1: #thread loop
-		if stopThreads.is_set(): #need to close thread
-			break
+	#the line is closed also if the thread crashes, so a restarted thread can open it again
+	try:
+		while 1: #thread loop
+			if wk.stopping(): #need to close thread
+				break
+			wk.beat()
+		
+			#taking the schema for the whole loop (it can be swapped by a reload)
+			schema=msg
 	
-		#try receiving data from client queue
-		try:
-			data=clientQueueRx.get(timeout=clientQueueRxTimeout)
-		except:
-			pass
-		else: #something received
-			if data.split(maxsplit=1)[0]=="help":
-				helpstring='Available commands (array elements should be passed inside quotes " "):\n'
-				for available in availableCommands:
-					try:
-						helpstring+="{0}\n\n".format(msg.msgDict[available]())
-					except:
-						pass
-						
-				clientQueueTx.put(helpstring)
+			#waiting for serial data (so frames are read as soon as they arrive),
+			#the timeout also sets how often the line command queue is checked
+			#(shortened if a scheduled command is due before)
+			if rxIdle:
+				waitTime=lineQueueTimeout
+				schedTime=sched.timeToNext(time.time_ns(),ownCommand)
+				if schedTime is not None:
+					waitTime=min(waitTime,schedTime)
+				serial.waitLine(line,ctypes.c_float(waitTime))
 			
+			#dispatching scheduled commands which are due
+			for entry in sched.popDue(time.time_ns(),ownCommand):
+				sentTime=time.time_ns()
+				retVal=serial.sendLine(line,entry[2],len(entry[2]),1) #requesting also an ack from the board
+				sched.dispatched(entry,sentTime,retVal)
+				if retVal:
+					diagLog.info("Scheduled command {0} ({1}) sent {2:.3f} ms after due time",entry[1],entry[3],(sentTime-entry[0])/1e6)
+				else:
+					diagLog.error("{0} didn't acknowledge scheduled command {1} ({2})",lineName,entry[1],entry[3])
+	
+			#sending the messages coming from client
+			try:
+				bufftx,name=lineQueue.get_nowait()
+			except:
+				pass
 			else:
-				#Here we handle all the possible commands from client
-				try:
-					#extract message struct from command string
-					msgStruct=msg.parseStruct(data)
-					if msgStruct.code not in availableCommands:
-						raise Exception
-				except:
-					clientQueueTx.put("ERROR: the requested command was not recognized or the arguments format is wrong\nYou can list avilable commands with 'help'\n")
+				retVal=serial.sendLine(line,bufftx,len(bufftx),1) #requesting also an ack from the board
+				if retVal:
+					clientQueueTx.put("{0} message sent\n".format(name))
 				else:
-					#send message over serial
-					bufftx=bytes(msgStruct)
-					retVal=serial.sendUART(bufftx,len(bufftx),1) #requesting also an ack from ADCS
-					if retVal:
-						clientQueueTx.put("{0} message sent\n".format(data.split(maxsplit=1)[0]))
+					clientQueueTx.put("ERROR, {0} didn't acknowledge {1}\n".format(lineName,name))
+
+			#try reading message from serial
+			l=serial.receiveLine(line,buffrx,len(buffrx),ctypes.byref(rxMono),ctypes.byref(rxReal))
+			if l<0: #the supervisor will reopen the line
+				raise Exception("line {0} ({1} {2}) closed by the other end or hung up".format(lineName,settings["transport"],settings["dev"]))
+			rxIdle=(l==0)
+
+			if l != 0:
+				#check message code
+				code=ord(buffrx[0])
+				#if the code and the length correspond to a valid message
+				if code in schema.msgDict.keys() and ctypes.sizeof(schema.msgDict[code]) == l:
+					msgClass=schema.msgDict[code]
+					if not lineCarries(schema,code,lineName): #code declared for another board
+						diagLog.warning("Received {0} from {1}, which doesn't carry it, discarded",msgClass.__name__,lineName)
+					elif msgClass.direction!="telemetry": #boards only send telemetry
+						diagLog.warning("Received {0} command from {1}, discarded",msgClass.__name__,lineName)
 					else:
-						clientQueueTx.put("ERROR, ADCS didn't acknowledge {0}\n".format(data.split(maxsplit=1)[0]))
+						#queueing the raw frame, it's decoded by the log thread
+						logQueue.put(telemetryFrame(msgClass,lineName,ctypes.string_at(buffrx,l),rxMono.value,rxReal.value))
+						enqueueLatency.add(time.monotonic_ns()-rxMono.value)
 					
-						
-		#try reading message from serial
-		buffrx=bytes(serial.getMaxLen())
-		l=serial.receiveUART(buffrx,len(buffrx))
-
-		if l != 0:
-			#check message code
-			code=buffrx[0]
-			#if the code and the length correspond to a valid message
-			if code in msg.msgDict.keys() and ctypes.sizeof(msg.msgDict[code]) == l:
-				# ------ HERE WE HANDLE EACH MESSAGE CODE FROM ADCS -------			
-				match msg.msgDict[code].__name__:
-					case "attitudeADCS" | "housekeepingADCS" | "opmodeADCS": #attitude telemetry message
-						#saving current timestamp
-						currt=time.time_ns()
-						
-						#creating the corresponding message struct
-						newstruct=msg.msgDict[code].from_buffer_copy(buffrx[:l])
-						
-						#building influxdb write string
-						influxstr=msg.msgDict[code].__name__+"," #inserting message name as dataset name
-						influxstr+="source=ADCS "#inserting source tag
-						#iteratively inserting all fields
-						for f in newstruct._fields_:
-							#checking if value is an array
-							if isinstance(getattr(newstruct,f[0]),ctypes.Array):
-								arraylist=getattr(newstruct,f[0])[:]
-								for index in range(len(arraylist)):
-									influxstr+="{0}={1}".format("{0}[{1}]".format(f[0],index),arraylist[index])
-									if (index+1)!=len(arraylist):
-										influxstr+=","							
-							else:
-								influxstr+="{0}={1}".format(f[0],getattr(newstruct,f[0]))
-							if f!=newstruct._fields_[-1]:
-								influxstr+=","
-						
-						#appending timestamp
-						influxstr+=" {0}\n".format(currt)
-						
-						#sending to telegraf queue
-						logQueue.put(influxstr)
-						
-					case _: #default case
-						print("WARNING: {0} message from ADCS not handled".format(msg.msgDict[code].__name__))
-			else:
-				print("WARNING: Received unknown message from ADCS (code {0} length {1})".format(code, l))
-	
-	print("Closing UART")	
-	serial.deinitUART()
+						#measuring the time to the first processed frame (only once, not after restarts)
+						if "startupToFirstFrameMs" not in daemonStats:
+							firstFrameTime=(time.monotonic()-startTime)*1000
+							daemonStats["startupToFirstFrameMs"]=round(firstFrameTime,3)
+							diagLog.info("First frame processed {0:.1f} ms after startup",firstFrameTime)
+				else:
+					diagLog.warning("Received unknown message from {0} (code {1} length {2})",lineName,code,l)
+	finally:
+		diagLog.info("Closing line {0}",lineName)
+		closeSerialLine(line)
 
 
+#allocations are attributed to the subsystem whose thread function is in their traceback
+memTracer=memStats.AllocationTracer({"adc":adcThread,"client":clientThread,"cdh":cdhThread,"log":logThread,"reloadSchema":reloadSchemaThread})
+
 #running all threads
-print("Starting threads")
-adcT=threading.Thread(target=adcThread, daemon=True)
-cliT=threading.Thread(target=clientThread, daemon=True)	
-cdhT=threading.Thread(target=cdhThread, daemon=True)	
-logT=threading.Thread(target=logThread, daemon=True)
-	
-adcT.start()
-cliT.start()
-cdhT.start()
-logT.start()
+diagLog.info("Starting threads")
+sv.add("adc",adcThread,adcHeartbeatTimeout)
+sv.add("client",clientThread,heartbeatTimeout)
+for name in serialLines: #one CDH thread for each serial line
+	sv.add("cdh"+name,functools.partial(cdhThread,lineName=name),heartbeatTimeout)
+sv.add("log",logThread,heartbeatTimeout)
+sv.start()
 
-print("All threads started")
+diagLog.info("All threads started")
 
 def stop_handler(sig, frame): #handler function for stop signals
 	global stopThreads
-	global adcT
-	global cliT
-	global cdhT
-	global logT
+	global sv
 	global threadTermTimeout
 
 	stopThreads.set() #stopping all threads
 	
-	print("Received termination signal")
+	diagLog.info("Received termination signal")
 	
 	#waiting for all threads to join
-	adcT.join(timeout=threadTermTimeout)
-	cliT.join(timeout=threadTermTimeout)
-	cdhT.join(timeout=threadTermTimeout)
-	logT.join(timeout=threadTermTimeout)
+	sv.join(threadTermTimeout)
 	
-	print("All threads terminated or timed out, BYE!")
+	diagLog.info("All threads terminated or timed out, BYE!")
 	sys.exit()
 	
 #setting signal handler
 signal.signal(signal.SIGTERM, stop_handler)
 signal.signal(signal.SIGINT, stop_handler)
 
+lastStatsTime=time.monotonic()
 while 1:
-	#checking if all threads are still alive
-	allAlive=True
-	if not adcT.is_alive():
-		allAlive=False
-	if not cliT.is_alive():
-		allAlive=False
-	if not cdhT.is_alive():
-		allAlive=False
-	if not logT.is_alive():
-		allAlive=False
-		
-	if not allAlive:
-		print("A thread unexpectedly closed, terminating execution")
-		os.kill(os.getpid(),signal.SIGTERM)
+	#checking subsystems heartbeats and restarting the failed ones
+	#(only the failed thread is restarted, queues are kept)
+	timeout=sv.poll()
 	
-	time.sleep(1)
-			
+	#periodically sending daemon statistics to telegraf
+	if time.monotonic()-lastStatsTime>=statsPeriod:
+		lastStatsTime=time.monotonic()
+		logQueue.put(statsLine())
+	
+	#woken up immediately if a thread crashes
+	sv.wait(timeout)
@@ -30,6 +30,7 @@ echo [Service] >> CDH.service &&
 echo User=$USER >> CDH.service &&
 echo WorkingDirectory=$PWD >> CDH.service &&
 echo ExecStart=$PWD/CDHdaemon.py >> CDH.service &&
+echo EnvironmentFile=-/etc/default/telegraf >> CDH.service &&
 echo Restart=always >> CDH.service &&
 echo >> CDH.service &&
 echo [Install] >> CDH.service &&
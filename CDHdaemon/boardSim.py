@@ -0,0 +1,132 @@
+#Simulated ADCS board
+
+#Speaks the simpleDataLink protocol on a line of serialInterface.so
+#(any transport), generating attitudeADCS, housekeepingADCS and
+#opmodeADCS frames at the requested rates and acking the commands it
+#receives (setOpmodeADCS changes the reported opmode).
+#Used by simADCS.py on its pty and by the daemon itself on the peer end
+#of its in-process transports (memory pipe and socket pair), so the whole
+#framing and ack stack can be driven without hardware.
+
+import ctypes
+import math
+import random
+import threading
+import time
+
+defaultRates={"attitudeADCS":10,"housekeepingADCS":1,"opmodeADCS":0.2} #frames per second
+maxWait=0.005 #maximum time (s) between two checks of the line and of the generators
+
+#generates the frames of a telemetry message with slowly varying values
+class frameGenerator:
+	def __init__(self,msgClass,rate,startt):
+		self.msgClass=msgClass
+		self.period=1/rate if rate>0 else math.inf
+		self.next=time.monotonic()
+		self.startt=startt
+		self.sent=0
+		self.skipped=0 #frames not sent (frameLoss)
+		self.opmode=0
+
+	def frame(self):
+		s=self.msgClass()
+		t=time.monotonic()-self.startt
+		fieldIndex=0
+		for f in s._fields_[1:]:
+			fieldIndex+=1
+			if f[0]=="ticktime": #scheduled time of the frame (ms), so the daemon sees a steady period
+				s.ticktime=int((self.next-self.startt)*1000)&0xFFFFFFFF
+			elif f[0]=="opmode":
+				s.opmode=self.opmode
+			elif issubclass(f[1],ctypes.Array):
+				arr=getattr(s,f[0])
+				for i in range(len(arr)):
+					arr[i]=self.value(arr._type_,t,fieldIndex*16+i)
+			else:
+				setattr(s,f[0],self.value(f[1],t,fieldIndex))
+		self.sent+=1
+		return bytes(s)
+
+	def value(self,ctype,t,seed):
+		v=math.sin(t/(10+seed))+random.gauss(0,0.05)
+		if ctype is ctypes.c_float:
+			return 20+10*v
+		maxVal=(1<<(8*ctypes.sizeof(ctype)))-1
+		return int((v+1.5)/3*maxVal)&maxVal
+
+class BoardSimulator:
+	#serial is the loaded serialInterface.so, line an open line index, schema the
+	#loaded messages module, rates message name -> frames per second
+	def __init__(self,serial,line,schema,rates=None,frameLoss=0,burstSize=0,burstPeriod=10):
+		self.serial=serial
+		self.line=line
+		self.schema=schema
+		self.frameLoss=frameLoss #probability of skipping a telemetry frame at the source
+		self.burstSize=burstSize #extra attitudeADCS frames sent back to back at every burst
+		self.burstPeriod=burstPeriod
+		self.startt=time.monotonic()
+		msgByName={schema.msgDict[code].__name__:schema.msgDict[code] for code in schema.msgDict}
+		rates=dict(defaultRates,**(rates or {}))
+		self.generators={name:frameGenerator(msgByName[name],rate,self.startt) for name,rate in rates.items()}
+		self.nextBurst=self.startt+burstPeriod if burstSize>0 and "attitudeADCS" in self.generators else math.inf
+		self.commandsIn={} #command code -> commands received
+		self.buffrx=ctypes.create_string_buffer(serial.getMaxLen())
+		self.stop=threading.Event()
+		self.thread=None
+
+	#receives and acks the commands, sends the frames which are due,
+	#returns the time of the next due frame
+	def step(self,now):
+		while 1:
+			l=self.serial.receiveLine(self.line,self.buffrx,len(self.buffrx),None,None)
+			if l<=0:
+				break
+			code=ord(self.buffrx[0])
+			self.commandsIn[code]=self.commandsIn.get(code,0)+1
+			if code in self.schema.msgDict and self.schema.msgDict[code].__name__=="setOpmodeADCS" and l>1 and "opmodeADCS" in self.generators:
+				self.generators["opmodeADCS"].opmode=ord(self.buffrx[1])
+
+		#sending periodic frames
+		for g in self.generators.values():
+			if now>=g.next:
+				bufftx=g.frame()
+				if self.frameLoss and random.random()<self.frameLoss:
+					g.sent-=1
+					g.skipped+=1
+				else:
+					self.serial.sendLine(self.line,bufftx,len(bufftx),0)
+				g.next+=g.period
+				if now-g.next>1: #too late (system was busy), not trying to catch up
+					g.next=now+g.period
+
+		#sending bursts
+		if now>=self.nextBurst:
+			self.nextBurst+=self.burstPeriod
+			g=self.generators["attitudeADCS"]
+			for _ in range(self.burstSize):
+				bufftx=g.frame()
+				self.serial.sendLine(self.line,bufftx,len(bufftx),0)
+
+		return min([g.next for g in self.generators.values()]+[self.nextBurst])
+
+	#runs the simulator until stop is set or the other end of the line is
+	#closed (waiting on the line, so commands are acked as soon as they arrive)
+	def run(self,until=math.inf):
+		while not self.stop.is_set():
+			now=time.monotonic()
+			if now>=until:
+				break
+			nextDue=min(self.step(now),until)
+			if self.serial.waitLine(self.line,ctypes.c_float(min(maxWait,max(0,nextDue-time.monotonic()))))<0:
+				break
+
+	#starts the simulator in a background thread
+	def start(self,name="boardSim"):
+		self.thread=threading.Thread(target=self.run,name=name,daemon=True)
+		self.thread.start()
+
+	def stats(self):
+		stats={"simFrames"+name[0].upper()+name[1:]:g.sent for name,g in self.generators.items()}
+		stats["simFramesSkipped"]=sum(g.skipped for g in self.generators.values())
+		stats["simCommandsIn"]=sum(list(self.commandsIn.values())) #copied, the simulator thread can add codes meanwhile
+		return stats
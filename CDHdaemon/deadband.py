@@ -0,0 +1,127 @@
+#Change-only (deadband) filter for telemetry fields
+
+#Thresholds are read from the "deadband" section of each message in
+#messages.json, a field is emitted only when it moved more than its
+#threshold from the last value sent, or when it was not sent for
+#more than the heartbeat interval (so no series goes stale).
+#Fields without a threshold are sent every time the line is sent, a
+#line with no field to send is suppressed entirely (tick counter field
+#included, so downstream tick gaps include the suppressed lines: their
+#number is counted per message for telegraf/verifyLoss.py).
+
+from array import array
+import ctypes
+import math
+
+#last sent state of a series (measurement+source), kept in arrays
+#indexed like the flattened fields of the message
+class seriesState:
+	__slots__=("values","sentTimes")
+
+	def __init__(self,fieldNum):
+		self.values=array("d",[math.nan])*fieldNum
+		self.sentTimes=array("d",[-math.inf])*fieldNum
+
+#per message class data computed once: thresholds of the flattened
+#fields and heartbeat
+class messagePlan:
+	__slots__=("filtered","absTh","relTh","heartbeat","anyFiltered")
+
+	def __init__(self,msgClass,defaultHeartbeat):
+		deadband=getattr(msgClass,"deadband",{})
+		heartbeat=getattr(msgClass,"heartbeat",None)
+		self.heartbeat=defaultHeartbeat if heartbeat is None else heartbeat
+
+		self.filtered=[]
+		self.absTh=array("d")
+		self.relTh=array("d")
+		for f in msgClass._fields_:
+			th=deadband.get(f[0],None)
+			for _ in range(f[1]._length_ if issubclass(f[1],ctypes.Array) else 1):
+				self.filtered.append(th is not None)
+				self.absTh.append(th.get("abs",math.inf) if th else 0)
+				self.relTh.append(th.get("rel",math.inf) if th else 0)
+		self.anyFiltered=any(self.filtered)
+
+class DeadbandFilter:
+	def __init__(self,defaultHeartbeat):
+		self.defaultHeartbeat=defaultHeartbeat
+		self.plans={} #message class -> messagePlan
+		self.series={} #(message name, source) -> seriesState
+
+		#counters
+		self.linesIn=0
+		self.linesSuppressed=0
+		self.fieldsIn=0
+		self.fieldsSuppressed=0
+		self.suppressedByMessage={} #message name -> lines suppressed
+
+	#returns the plan of a message class (building it on first use)
+	def plan(self,msgClass):
+		p=self.plans.get(msgClass,None)
+		if p is None:
+			p=messagePlan(msgClass,self.defaultHeartbeat)
+			self.plans[msgClass]=p
+		return p
+
+	#takes the flattened values of a message and returns the list of
+	#indexes of the fields to be sent (empty list if the line should
+	#be suppressed), now is a time in seconds (monotonic)
+	def filter(self,msgClass,source,values,now):
+		p=self.plan(msgClass)
+		n=len(values)
+		self.linesIn+=1
+		self.fieldsIn+=n
+
+		if not p.anyFiltered:
+			return range(n)
+
+		key=(msgClass.__name__,source)
+		state=self.series.get(key,None)
+		if state is None or len(state.values)!=n: #new series or schema changed
+			state=seriesState(n)
+			self.series[key]=state
+
+		lastValues=state.values
+		sentTimes=state.sentTimes
+		emit=[]
+		changed=False
+		for i in range(n):
+			if not p.filtered[i]:
+				emit.append(i)
+				continue
+			v=values[i]
+			last=lastValues[i]
+			delta=abs(v-last)
+			if (now-sentTimes[i])>=p.heartbeat or delta>p.absTh[i] or delta>p.relTh[i]*abs(last) or (delta!=delta and (v==v or last==last)):
+				emit.append(i)
+				lastValues[i]=v
+				sentTimes[i]=now
+				changed=True
+
+		if not changed:
+			self.linesSuppressed+=1
+			self.suppressedByMessage[key[0]]=self.suppressedByMessage.get(key[0],0)+1
+			self.fieldsSuppressed+=n
+			return []
+
+		self.fieldsSuppressed+=n-len(emit)
+		return emit
+
+	#drops the last sent state, so every field is sent again
+	def reset(self):
+		self.series.clear()
+		self.plans.clear()
+
+	def stats(self):
+		stats={
+			"deadbandLinesIn":self.linesIn,
+			"deadbandLinesSuppressed":self.linesSuppressed,
+			"deadbandFieldsIn":self.fieldsIn,
+			"deadbandFieldsSuppressed":self.fieldsSuppressed,
+			"deadbandLineSuppressionRatio":round(self.linesSuppressed/self.linesIn,4) if self.linesIn else 0,
+			"deadbandFieldSuppressionRatio":round(self.fieldsSuppressed/self.fieldsIn,4) if self.fieldsIn else 0
+		}
+		for name,lines in list(self.suppressedByMessage.items()): #copied, the log thread can add messages meanwhile
+			stats["deadbandLinesSuppressed"+name[0].upper()+name[1:]]=lines
+		return stats
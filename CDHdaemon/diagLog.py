@@ -0,0 +1,196 @@
+#Diagnostic logging for the daemon and its modules
+
+#Messages have a severity level and a key (by default the message format
+#string, so all the messages coming from the same call share it): every
+#key can emit at most rateBurst messages every ratePeriod seconds, the
+#following ones are only counted and a summary with the number of
+#suppressed messages is emitted when the period ends.
+#Emitted messages are kept in a ring of recent events (readable from the
+#client with "events") and written on stdout by a background writer
+#thread, so the calling thread never blocks on stdout: if the writer
+#can't keep up, messages are dropped (and counted) instead of waiting.
+#Before start() (or when used outside the daemon) messages are written
+#synchronously.
+
+import atexit
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG=10
+INFO=20
+WARNING=30
+ERROR=40
+levelNames={DEBUG:"DEBUG",INFO:"INFO",WARNING:"WARNING",ERROR:"ERROR"}
+
+#rate limiting state of a message key
+class keyState:
+	__slots__=("windowStart","count","suppressed","level","fmt")
+
+	def __init__(self,now,level,fmt):
+		self.windowStart=now
+		self.count=0
+		self.suppressed=0
+		self.level=level
+		self.fmt=fmt
+
+class DiagLog:
+	def __init__(self,level=INFO,rateBurst=5,ratePeriod=60,ringSize=1000,queueSize=10000,stream=None):
+		self.level=level
+		self.rateBurst=rateBurst #messages allowed per key in a period
+		self.ratePeriod=ratePeriod #rate limiting period (s)
+		self.stream=stream
+		self.ring=deque(maxlen=ringSize) #recent events: (time, level, text)
+		self.queue=queue.Queue(queueSize) #texts waiting for the writer
+		self.keys={} #message key -> keyState
+		self.lock=threading.Lock()
+		self.writer=None
+		self.stop=threading.Event()
+
+		#counters
+		self.emitted=0
+		self.suppressed=0
+		self.dropped=0
+
+	def configure(self,level=None,rateBurst=None,ratePeriod=None):
+		if level is not None:
+			self.level=level
+		if rateBurst is not None:
+			self.rateBurst=rateBurst
+		if ratePeriod is not None:
+			self.ratePeriod=ratePeriod
+
+	#starts the writer thread
+	def start(self):
+		if self.writer:
+			return
+		self.stop.clear()
+		self.writer=threading.Thread(target=self.run,name="diagLog",daemon=True)
+		self.writer.start()
+		atexit.register(self.close)
+
+	#logs fmt.format(*args) with the given level, key defaults to fmt
+	def log(self,level,fmt,*args,key=None):
+		if level<self.level:
+			return
+		now=time.monotonic()
+		with self.lock:
+			state=self.keys.get(key or fmt,None)
+			if state is None:
+				state=keyState(now,level,fmt)
+				self.keys[key or fmt]=state
+			elif now-state.windowStart>=self.ratePeriod:
+				self.summary(state,now)
+			state.count+=1
+			if state.count>self.rateBurst:
+				state.suppressed+=1
+				self.suppressed+=1
+				return
+		self.emit(level,fmt.format(*args) if args else fmt)
+
+	def debug(self,fmt,*args,key=None):
+		self.log(DEBUG,fmt,*args,key=key)
+
+	def info(self,fmt,*args,key=None):
+		self.log(INFO,fmt,*args,key=key)
+
+	def warning(self,fmt,*args,key=None):
+		self.log(WARNING,fmt,*args,key=key)
+
+	def error(self,fmt,*args,key=None):
+		self.log(ERROR,fmt,*args,key=key)
+
+	#emits the suppressed messages summary of a key and opens a new
+	#period (called with the lock held)
+	def summary(self,state,now):
+		if state.suppressed:
+			self.emit(state.level,"{0} similar messages suppressed in the last {1:.0f} s: {2}".format(state.suppressed,now-state.windowStart,state.fmt))
+		state.windowStart=now
+		state.count=0
+		state.suppressed=0
+
+	def emit(self,level,text):
+		self.emitted+=1
+		self.ring.append((time.time(),level,text))
+		if level>=WARNING:
+			text="{0}: {1}".format(levelNames[level],text)
+		if not self.writer:
+			self.write([text])
+			return
+		try:
+			self.queue.put_nowait(text)
+		except queue.Full:
+			self.dropped+=1
+
+	def write(self,texts):
+		stream=self.stream or sys.stdout
+		try:
+			stream.write("\n".join(texts)+"\n")
+			stream.flush()
+		except:
+			pass
+
+	#writer thread: writes queued messages in batches and emits the
+	#summaries of the periods ended without new messages
+	def run(self):
+		lastSweep=time.monotonic()
+		while not self.stop.is_set() or not self.queue.empty():
+			try:
+				texts=[self.queue.get(timeout=1)]
+			except queue.Empty:
+				texts=[]
+			while len(texts)<1000:
+				try:
+					texts.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+			if texts:
+				self.write(texts)
+
+			now=time.monotonic()
+			if now-lastSweep>=1:
+				lastSweep=now
+				with self.lock:
+					for key,state in list(self.keys.items()):
+						if now-state.windowStart>=self.ratePeriod:
+							if state.suppressed:
+								self.summary(state,now)
+							else:
+								del self.keys[key] #idle key
+		self.writer=None
+
+	#writes everything still queued and stops the writer
+	def close(self):
+		writer=self.writer
+		if writer:
+			self.stop.set()
+			writer.join(timeout=2)
+
+	#returns the last n events as text
+	def recent(self,n):
+		events=list(self.ring)[-n:] if n>0 else []
+		outstr=""
+		for t,level,text in events:
+			outstr+="{0}.{1:03d} {2:<7} {3}\n".format(time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(t)),int(t*1000)%1000,levelNames[level],text)
+		return outstr or "No events\n"
+
+	def stats(self):
+		return {
+			"diagMessages":self.emitted,
+			"diagSuppressed":self.suppressed,
+			"diagDropped":self.dropped
+		}
+
+#default logger, shared by the daemon and its modules
+default=DiagLog()
+configure=default.configure
+start=default.start
+close=default.close
+debug=default.debug
+info=default.info
+warning=default.warning
+error=default.error
+recent=default.recent
+stats=default.stats
@@ -0,0 +1,29 @@
+#Fake smbus2 replacement for running the daemon without the ADC (ADS7828E)
+
+#Only the calls used by the daemon are implemented, every channel returns
+#a 12 bit conversion doing a small random walk around a mid scale value.
+#The daemon uses it instead of smbus2 when CDH_FAKE_SMBUS is set.
+
+import random
+
+channelNum=8 #number of ADC channels
+walkStep=4 #maximum change of a conversion between two reads (LSB)
+
+class SMBus:
+	def __init__(self,bus):
+		self.bus=bus
+		self.conv=[2048 for _ in range(channelNum)]
+		self.reads=0
+
+	def write_byte(self,address,value):
+		pass
+
+	#command is the ADS7828E command byte, the channel is in bits 4-6
+	def read_i2c_block_data(self,address,command,length):
+		ch=(command>>4)&0x07
+		self.conv[ch]=min(4095,max(0,self.conv[ch]+random.randint(-walkStep,walkStep)))
+		self.reads+=1
+		return [self.conv[ch]>>8,self.conv[ch]&0xFF][:length]
+
+	def close(self):
+		pass
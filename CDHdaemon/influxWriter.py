@@ -0,0 +1,177 @@
+#Batched InfluxDB v2 writer, alternative sink to the telegraf socket
+
+#Lines are collected in batches which are sent gzip compressed to the
+#/api/v2/write endpoint on a persistent (keep-alive) connection, a batch
+#is sent when it reaches batchLines lines or batchBytes bytes, or when
+#its oldest line is older than batchTime seconds.
+#Failed batches (connection errors, 429 and 5xx answers) are kept and
+#retried with exponential backoff, while new lines keep being batched up
+#to maxBufferLines, then the oldest lines are dropped (and counted).
+#Every poll() sends at most one batch, so after an outage the backlog is
+#drained across many calls and the caller (the log thread) keeps beating
+#its heartbeat between requests.
+
+import gzip
+import http.client
+import time
+import urllib.parse
+from collections import deque
+
+import diagLog
+
+class InfluxWriter:
+	def __init__(self,url,token,org,bucket,batchLines=5000,batchBytes=256*1024,batchTime=1.0,maxBufferLines=100000,retryMin=1,retryMax=60,timeout=5,gzipLevel=6):
+		parsed=urllib.parse.urlsplit(url)
+		self.https=parsed.scheme=="https"
+		self.host=parsed.hostname
+		self.port=parsed.port
+		self.path="{0}/api/v2/write?{1}".format(parsed.path.rstrip("/"),urllib.parse.urlencode({"org":org,"bucket":bucket,"precision":"ns"}))
+		self.headers={
+			"Authorization":"Token {0}".format(token),
+			"Content-Type":"text/plain; charset=utf-8",
+			"Content-Encoding":"gzip",
+			"Accept":"application/json"
+		}
+		self.batchLines=batchLines
+		self.batchBytes=batchBytes
+		self.batchTime=batchTime
+		self.maxBufferLines=maxBufferLines
+		self.retryMin=retryMin
+		self.retryMax=retryMax
+		self.timeout=timeout
+		self.gzipLevel=gzipLevel
+
+		self.conn=None
+		self.lines=[] #lines (bytes) of the batch being filled
+		self.arrivals=[] #arrival times of the lines of the batch being filled
+		self.batchSize=0 #bytes in the batch being filled
+		self.batchStart=0 #time of the first line of the batch being filled
+		self.pending=deque() #closed batches waiting to be sent: (lines, arrivals)
+		self.pendingLines=0
+		self.retryTime=0 #time before which no request is made
+		self.failures=0 #consecutive failures (for backoff)
+		self.lastError=None
+
+		#counters
+		self.linesSent=0
+		self.linesDropped=0
+		self.batchesSent=0
+		self.requestErrors=0
+		self.bytesRaw=0
+		self.bytesSent=0
+
+	#adds a line (with its arrival time, or None) to the current batch
+	def write(self,line,arrival=None):
+		if not self.lines:
+			self.batchStart=time.monotonic()
+		self.lines.append(line)
+		self.arrivals.append(arrival)
+		self.batchSize+=len(line)
+		if len(self.lines)>=self.batchLines or self.batchSize>=self.batchBytes:
+			self.closeBatch()
+
+	def closeBatch(self):
+		if not self.lines:
+			return
+		self.pending.append((self.lines,self.arrivals))
+		self.pendingLines+=len(self.lines)
+		self.lines=[]
+		self.arrivals=[]
+		self.batchSize=0
+		#dropping the oldest batches if too many lines are buffered
+		while self.pendingLines>self.maxBufferLines and len(self.pending)>1:
+			lines,_=self.pending.popleft()
+			self.pendingLines-=len(lines)
+			self.linesDropped+=len(lines)
+
+	def connect(self):
+		if self.https:
+			self.conn=http.client.HTTPSConnection(self.host,self.port,timeout=self.timeout)
+		else:
+			self.conn=http.client.HTTPConnection(self.host,self.port,timeout=self.timeout)
+
+	#sends a batch, returns "sent", "rejected" (the batch is dropped) or
+	#"retry" (the batch should be sent again later)
+	def post(self,lines):
+		body=b"".join(lines)
+		data=gzip.compress(body,self.gzipLevel)
+		try:
+			if self.conn is None:
+				self.connect()
+			self.conn.request("POST",self.path,body=data,headers=self.headers)
+			resp=self.conn.getresponse()
+			answer=resp.read()
+		except Exception as e:
+			self.requestErrors+=1
+			self.lastError=str(e)
+			if self.conn:
+				self.conn.close()
+			self.conn=None
+			return "retry"
+
+		if resp.status==204:
+			self.bytesRaw+=len(body)
+			self.bytesSent+=len(data)
+			return "sent"
+
+		self.requestErrors+=1
+		self.lastError="HTTP {0} {1}".format(resp.status,answer[:200].decode("utf-8","replace"))
+		if resp.status==429 or resp.status>=500: #server busy or failing, retrying
+			retryAfter=resp.getheader("Retry-After")
+			if retryAfter and retryAfter.isdigit():
+				self.retryTime=time.monotonic()+int(retryAfter)
+			return "retry"
+
+		#other errors (bad request, unauthorized, ...) won't be fixed by retrying
+		self.linesDropped+=len(lines)
+		diagLog.error("InfluxDB rejected a batch of {0} lines ({1})",len(lines),self.lastError)
+		return "rejected"
+
+	#sends up to maxBatches of the batches that are ready (one by default, a
+	#request can take up to timeout seconds), returns the arrival times of the lines sent
+	def poll(self,maxBatches=1):
+		now=time.monotonic()
+		if self.lines and now-self.batchStart>=self.batchTime:
+			self.closeBatch()
+
+		sentArrivals=[]
+		while self.pending and now>=self.retryTime and maxBatches>0:
+			maxBatches-=1
+			lines,arrivals=self.pending[0]
+			result=self.post(lines)
+			if result=="retry":
+				self.failures+=1
+				delay=min(self.retryMax,self.retryMin*2**(self.failures-1))
+				self.retryTime=max(self.retryTime,now+delay)
+				diagLog.error("Failed to write to InfluxDB ({0}), retrying in {1} seconds",self.lastError,delay)
+				break
+			self.failures=0
+			self.pending.popleft()
+			self.pendingLines-=len(lines)
+			if result=="sent":
+				self.linesSent+=len(lines)
+				self.batchesSent+=1
+				sentArrivals.extend(arrivals)
+			now=time.monotonic()
+		return sentArrivals
+
+	#sends everything still buffered (a single try), used on close
+	def flush(self):
+		self.closeBatch()
+		self.retryTime=0
+		return self.poll(len(self.pending))
+
+	def close(self):
+		if self.conn:
+			self.conn.close()
+			self.conn=None
+
+	def stats(self):
+		return {
+			"influxLinesSent":self.linesSent,
+			"influxLinesDropped":self.linesDropped,
+			"influxLinesBuffered":self.pendingLines+len(self.lines),
+			"influxBatchesSent":self.batchesSent,
+			"influxRequestErrors":self.requestErrors,
+			"influxCompressionRatio":round(self.bytesSent/self.bytesRaw,4) if self.bytesRaw else 0
+		}
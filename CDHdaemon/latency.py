@@ -0,0 +1,57 @@
+#Latency histogram with power of two buckets
+
+#Bucket i counts the samples between 2^(i-1) and 2^i microseconds (bucket
+#0 the ones below 1 us), so recording a sample costs only a bit_length()
+#and the whole histogram is a small fixed array, it can be kept for the
+#entire life of the daemon.
+
+from array import array
+
+bucketNum=32 #last bucket collects everything above ~36 minutes
+
+class LatencyHistogram:
+	def __init__(self,name):
+		self.name=name
+		self.buckets=array("Q",[0])*bucketNum
+		self.count=0
+		self.sum=0 #ns
+		self.max=0 #ns
+
+	#records a latency in nanoseconds
+	def add(self,ns):
+		if ns<0: #clocks of different threads can't go backwards, but be safe
+			ns=0
+		self.buckets[min(bucketNum-1,(ns//1000).bit_length())]+=1
+		self.count+=1
+		self.sum+=ns
+		if ns>self.max:
+			self.max=ns
+
+	#returns the upper bound (ms) of the bucket containing the q quantile
+	def quantile(self,q):
+		if self.count==0:
+			return 0
+		target=q*self.count
+		acc=0
+		for i in range(bucketNum):
+			acc+=self.buckets[i]
+			if acc>=target:
+				return (1<<i)/1000
+		return (1<<(bucketNum-1))/1000
+
+	def stats(self):
+		return {
+			self.name+"Count":self.count,
+			self.name+"MeanMs":round(self.sum/self.count/1e6,3) if self.count else 0,
+			self.name+"P50Ms":self.quantile(0.5),
+			self.name+"P99Ms":self.quantile(0.99),
+			self.name+"MaxMs":round(self.max/1e6,3)
+		}
+
+	#returns the histogram as text, one line per non empty bucket
+	def __str__(self):
+		outstr="{0} ({1} samples, max {2:.3f} ms):\n".format(self.name,self.count,self.max/1e6)
+		for i in range(bucketNum):
+			if self.buckets[i]:
+				outstr+="  <{0:>12.3f} ms {1}\n".format((1<<i)/1000,self.buckets[i])
+		return outstr
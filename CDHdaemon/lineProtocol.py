@@ -0,0 +1,139 @@
+#InfluxDB line protocol encoding of telemetry messages
+
+#Field types come from the schema (ctypes of messages.json): integer
+#fields are written with the "i" suffix so InfluxDB stores them as
+#integers, float fields (single precision on the line) are written with
+#the shortest text that reads back as the same float32 (e.g. 0.1 instead
+#of the double 0.10000000149011612) or with the number of significant
+#digits given in the "precision" section of the message.
+#Array elements become one field each, their key style is configurable:
+#	bracket:    temperature[0]
+#	underscore: temperature_0
+#	dot:        temperature.0
+#Non finite floats (nan, inf) can't be written in line protocol, those
+#fields are skipped.
+
+import ctypes
+import math
+from struct import Struct
+
+arrayKeyFormats={"bracket":"{0}[{1}]","underscore":"{0}_{1}","dot":"{0}.{1}"}
+float32=Struct("<f")
+maxFloat32Digits=9 #significant digits that always round-trip a float32
+
+#returns the shortest text of v that reads back as the same float32
+def float32Text(v):
+	packed=float32.pack(v)
+	#if p digits round-trip, so do p+1 (the nearest p digits decimal is
+	#also a p+1 digits one), so the shortest is found by bisection
+	low,high=1,maxFloat32Digits
+	while low<high:
+		p=(low+high)//2
+		if float32.pack(float("%.*g"%(p,v)))==packed:
+			high=p
+		else:
+			low=p+1
+	text="%.*g"%(low,v)
+	#large integral values can be shorter without exponent (40555392 instead of 4.055539e+07)
+	if "e+" in text and v.is_integer() and len(text)>len("%d"%v):
+		return "%d"%v
+	return text
+
+#per message class data computed once: field keys and formats
+class encodePlan:
+	__slots__=("keys","prefixes","kinds","digits")
+
+	def __init__(self,msgClass,arrayKeys,intSuffix):
+		precision=getattr(msgClass,"precision",{})
+		keyFormat=arrayKeyFormats[arrayKeys]
+		self.keys=[] #flattened field keys
+		self.prefixes=[] #"key=" of every field
+		self.kinds=[] #0 integer, 1 float32 shortest, 2 float with fixed significant digits, 3 integer written as float
+		self.digits=[] #significant digits (kind 2)
+		for f in msgClass._fields_:
+			ctype=f[1]
+			if issubclass(ctype,ctypes.Array):
+				keys=[keyFormat.format(f[0],index) for index in range(ctype._length_)]
+				ctype=ctype._type_
+			else:
+				keys=[f[0]]
+			if ctype in (ctypes.c_float,ctypes.c_double):
+				kind=2 if f[0] in precision else 1
+			else:
+				kind=0 if intSuffix else 3
+			for key in keys:
+				self.keys.append(key)
+				self.prefixes.append(key+"=")
+				self.kinds.append(kind)
+				self.digits.append(precision.get(f[0],0))
+
+class LineEncoder:
+	def __init__(self,arrayKeys="bracket",intSuffix=True):
+		if arrayKeys not in arrayKeyFormats:
+			raise ValueError("array key style {0} not valid, use one of {1}".format(arrayKeys,list(arrayKeyFormats)))
+		self.arrayKeys=arrayKeys
+		self.intSuffix=intSuffix #False writes integers as floats (for databases where those fields were created as floats)
+		self.plans={} #message class -> encodePlan
+
+		#counters
+		self.lines=0
+		self.bytes=0
+		self.fieldsSkipped=0
+		self.bytesByMessage={} #message name -> [lines, bytes]
+
+	#returns the plan of a message class (building it on first use)
+	def plan(self,msgClass):
+		p=self.plans.get(msgClass,None)
+		if p is None:
+			p=encodePlan(msgClass,self.arrayKeys,self.intSuffix)
+			self.plans[msgClass]=p
+		return p
+
+	#returns the line of the fields emit (indexes) of the flattened values of
+	#a message, tags is the ",tag=value" text, None if no field can be written
+	def line(self,msgClass,tags,values,emit,timestamp):
+		p=self.plan(msgClass)
+		prefixes=p.prefixes
+		kinds=p.kinds
+		fields=[]
+		for i in emit:
+			v=values[i]
+			kind=kinds[i]
+			if kind==0:
+				fields.append("{0}{1}i".format(prefixes[i],v))
+			elif kind==3:
+				fields.append("{0}{1}".format(prefixes[i],v))
+			elif not math.isfinite(v):
+				self.fieldsSkipped+=1
+			elif kind==1:
+				fields.append(prefixes[i]+float32Text(v))
+			else:
+				fields.append("{0}{1:.{2}g}".format(prefixes[i],v,p.digits[i]))
+		if not fields:
+			return None
+
+		name=msgClass.__name__
+		line="{0}{1} {2} {3}\n".format(name,tags,",".join(fields),timestamp)
+		self.lines+=1
+		self.bytes+=len(line)
+		counts=self.bytesByMessage.get(name,None)
+		if counts is None:
+			counts=self.bytesByMessage[name]=[0,0]
+		counts[0]+=1
+		counts[1]+=len(line)
+		return line
+
+	#drops the plans (schema reloaded)
+	def reset(self):
+		self.plans.clear()
+
+	def stats(self):
+		stats={
+			"lineProtoLines":self.lines,
+			"lineProtoBytes":self.bytes,
+			"lineProtoBytesPerLine":round(self.bytes/self.lines,1) if self.lines else 0,
+			"lineProtoFieldsSkipped":self.fieldsSkipped
+		}
+		for name,(lines,size) in list(self.bytesByMessage.items()): #copied, the log thread can add messages meanwhile
+			stats["lineProtoBytesPerLine"+name[0].upper()+name[1:]]=round(size/lines,1)
+		return stats
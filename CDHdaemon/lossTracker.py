@@ -0,0 +1,112 @@
+#Telemetry loss accounting
+
+#At the source, the tick counter field of the telemetry messages (ticktime
+#of attitudeADCS and housekeepingADCS) is followed per series
+#(measurement+source): the nominal period of the series is estimated as
+#the median of its last tick deltas, and a delta of more than gapFactor
+#periods counts the frames missing in between (lost by the ADCS, on the
+#line or by the serial library). A tick going back resets the series
+#(ADCS restart).
+#In the daemon, every line leaving the log thread is numbered (the number
+#can be added to the line as a sequence field) and the lines dropped
+#before reaching the sink are counted, so a verifier reading the sink
+#(telegraf/verifyLoss.py) can tell the lines lost after the daemon from
+#the ones lost inside it.
+
+from collections import deque
+
+#tick state of a series
+class tickSeries:
+	__slots__=("lastTick","deltas")
+
+	def __init__(self,tick,window):
+		self.lastTick=tick
+		self.deltas=deque(maxlen=window) #last tick deltas (for the period estimate)
+
+class LossTracker:
+	def __init__(self,tickField="ticktime",tickBits=32,gapFactor=1.5,window=16):
+		self.tickField=tickField
+		self.tickModulus=1<<tickBits #tick counter wrap
+		self.gapFactor=gapFactor
+		self.window=window
+		self.tickIndex={} #message class -> index of the tick field in the flattened values (None if missing)
+		self.series={} #(message name, source) -> tickSeries
+		self.seq=0 #last sequence number given to a line
+
+		#counters
+		self.framesIn=0
+		self.framesMissing=0
+		self.missingBySeries={}
+		self.resets=0
+		self.linesDropped=0
+
+	#returns the index of the tick field of a message class (None if it has none)
+	def tickFieldIndex(self,msgClass,keys):
+		if msgClass not in self.tickIndex:
+			self.tickIndex[msgClass]=keys.index(self.tickField) if self.tickField in keys else None
+		return self.tickIndex[msgClass]
+
+	#checks the tick of a received frame (flattened values, keys of the
+	#flattened fields), returns the number of frames missing before it
+	def frame(self,msgClass,source,values,keys):
+		index=self.tickFieldIndex(msgClass,keys)
+		if index is None:
+			return 0
+		return self.tick((msgClass.__name__,source),values[index])
+
+	#checks the tick of a frame of the series key (measurement, source),
+	#returns the number of frames missing before it
+	def tick(self,key,tick):
+		self.framesIn+=1
+		s=self.series.get(key,None)
+		if s is None:
+			self.series[key]=tickSeries(tick,self.window)
+			return 0
+
+		delta=(tick-s.lastTick)%self.tickModulus
+		s.lastTick=tick
+		if delta>=self.tickModulus//2: #tick went back, the source restarted
+			s.deltas.clear()
+			self.resets+=1
+			return 0
+		if delta==0: #same tick (frames sent back to back)
+			return 0
+
+		missing=0
+		if len(s.deltas)>=self.window//2:
+			period=sorted(s.deltas)[len(s.deltas)//2]
+			if delta>self.gapFactor*period:
+				missing=int(delta/period+0.5)-1
+				self.framesMissing+=missing
+				self.missingBySeries[key]=self.missingBySeries.get(key,0)+missing
+		if not missing: #gaps don't enter the period estimate
+			s.deltas.append(delta)
+		return missing
+
+	#returns the sequence number of the next line leaving the daemon
+	def nextSeq(self):
+		self.seq+=1
+		return self.seq
+
+	#counts lines dropped before reaching the sink
+	def dropped(self,lines=1):
+		self.linesDropped+=lines
+
+	#frames missing per series as text
+	def listing(self):
+		outstr="Source frames missing by series:\n"
+		for (name,source),s in self.series.items():
+			outstr+="  {0},source={1}: {2}\n".format(name,source,self.missingBySeries.get((name,source),0))
+		return outstr
+
+	def stats(self):
+		expected=self.framesIn+self.framesMissing
+		return {
+			"lossSourceFramesIn":self.framesIn,
+			"lossSourceFramesMissing":self.framesMissing,
+			"lossSourceRatio":round(self.framesMissing/expected,6) if expected else 0,
+			"lossSourceResets":self.resets,
+			"lossLinesOut":self.seq,
+			"lossLinesDropped":self.linesDropped,
+			"lossLinesDroppedRatio":round(self.linesDropped/self.seq,6) if self.seq else 0
+		}
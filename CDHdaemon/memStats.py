@@ -0,0 +1,130 @@
+#Memory usage instrumentation, used by the "mem" control command
+
+#Process memory is read from /proc/self/status, queues are measured by
+#walking their items (shallow sizes, one level into tuples and slot
+#based records). Allocations are traced with tracemalloc only on demand
+#("mem start"), since tracing slows down every allocation: each snapshot
+#is split by subsystem looking for a subsystem thread function in the
+#traceback of every allocation, and the top allocation sites are
+#reported with their growth since the previous snapshot.
+
+import gc
+import os
+import sys
+import threading
+import tracemalloc
+
+defaultFrames=25 #traceback depth kept by tracemalloc (enough to reach the thread functions)
+
+#returns the resident memory of the daemon (kB): current and peak
+def processMemory():
+	mem={"memRssKB":0,"memPeakRssKB":0}
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("VmRSS:"):
+					mem["memRssKB"]=int(line.split()[1])
+				elif line.startswith("VmHWM:"):
+					mem["memPeakRssKB"]=int(line.split()[1])
+	except:
+		pass
+	return mem
+
+#shallow size of an object, plus the size of the items of a tuple or
+#of the attributes of a slot based record
+def objectSize(obj):
+	size=sys.getsizeof(obj)
+	if isinstance(obj,tuple):
+		for item in obj:
+			size+=sys.getsizeof(item)
+	else:
+		for attr in getattr(type(obj),"__slots__",()):
+			size+=sys.getsizeof(getattr(obj,attr,None))
+	return size
+
+#returns the number of items of a queue.Queue and their size (bytes)
+def queueUsage(q):
+	with q.mutex:
+		items=list(q.queue)
+	return len(items),sys.getsizeof(q.queue)+sum(objectSize(item) for item in items)
+
+class AllocationTracer:
+	def __init__(self,subsystems):
+		#subsystem name -> thread function, allocations made by a
+		#function called by it are attributed to the subsystem
+		self.ranges=[]
+		for name,function in subsystems.items():
+			code=function.__code__
+			lastLine=max(line for _,_,line in code.co_lines() if line is not None)
+			self.ranges.append((code.co_filename,code.co_firstlineno,lastLine,name))
+		self.lastSnapshot=None
+		self.lock=threading.Lock() #snapshots can be requested by concurrent threads
+
+	def tracing(self):
+		return tracemalloc.is_tracing()
+
+	def start(self,frames=defaultFrames):
+		self.lastSnapshot=None
+		tracemalloc.start(frames)
+
+	def stop(self):
+		self.lastSnapshot=None
+		tracemalloc.stop()
+
+	#returns the subsystem of an allocation traceback
+	def subsystem(self,traceback):
+		for frame in traceback: #from the oldest frame
+			for filename,first,last,name in self.ranges:
+				if frame.lineno>=first and frame.lineno<=last and frame.filename==filename:
+					return name
+		return "other"
+
+	#takes a snapshot and returns (bytes by subsystem, top allocation
+	#sites as (site, bytes, growth since the previous snapshot, count))
+	def snapshot(self,top=10):
+		with self.lock:
+			snap=tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False,tracemalloc.__file__)])
+
+			bySubsystem={}
+			for stat in snap.statistics("traceback"):
+				name=self.subsystem(stat.traceback)
+				bySubsystem[name]=bySubsystem.get(name,0)+stat.size
+
+			if self.lastSnapshot:
+				stats=snap.compare_to(self.lastSnapshot,"lineno")
+			else:
+				stats=snap.statistics("lineno")
+			sites=[]
+			for stat in stats[:top]:
+				frame=stat.traceback[-1]
+				site="{0}:{1}".format(os.path.basename(frame.filename),frame.lineno)
+				sites.append((site,stat.size,getattr(stat,"size_diff",0),stat.count))
+			self.lastSnapshot=snap
+		return bySubsystem,sites
+
+	#returns the full text report: process memory, queues and buffers
+	#(name -> (items, bytes or None)), allocations if tracing
+	def report(self,queues,top=10):
+		mem=processMemory()
+		outstr="RSS: {0} kB (peak {1} kB)\n".format(mem["memRssKB"],mem["memPeakRssKB"])
+		outstr+="GC: {0} tracked objects, collections {1}\n".format(len(gc.get_objects()),[s["collections"] for s in gc.get_stats()])
+
+		outstr+="Queues and buffers:\n"
+		for name,(items,size) in queues.items():
+			outstr+="  {0:<24} {1:>8} items".format(name,items)
+			outstr+="  {0:>10.1f} kB\n".format(size/1024) if size is not None else "\n"
+
+		if not self.tracing():
+			outstr+="Allocation tracing is off, use 'mem start' to enable it ('mem stop' to disable)\n"
+			return outstr
+
+		bySubsystem,sites=self.snapshot(top)
+		current,peak=tracemalloc.get_traced_memory()
+		outstr+="Traced allocations: {0:.1f} kB (peak {1:.1f} kB, tracing overhead {2:.1f} kB)\n".format(current/1024,peak/1024,tracemalloc.get_tracemalloc_memory()/1024)
+		outstr+="By subsystem:\n"
+		for name,size in sorted(bySubsystem.items(),key=lambda s:-s[1]):
+			outstr+="  {0:<24} {1:>10.1f} kB\n".format(name,size/1024)
+		outstr+="Top {0} allocation sites (growth since the previous 'mem'):\n".format(len(sites))
+		for site,size,diff,count in sites:
+			outstr+="  {0:<32} {1:>10.1f} kB {2:>+10.1f} kB {3:>8} blocks\n".format(site,size/1024,diff/1024,count)
+		return outstr
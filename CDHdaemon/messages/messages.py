@@ -2,6 +2,7 @@
 # from messages.json
 
 from ctypes import *
+from struct import Struct
 import shlex
 
 # message name: opmodeADCS code: 20
@@ -19,6 +20,14 @@ class opmodeADCS(Structure):
 
 	convList=[int,int]
 
+	unpacker=Struct("<BB")
+
+	direction="telemetry"
+
+	deadband={'opmode': {'abs': 0}}
+	heartbeat=60
+	precision={}
+
 # message name: attitudeADCS code: 21
 class attitudeADCS(Structure):
 	def __init__(self):
@@ -46,6 +55,14 @@ class attitudeADCS(Structure):
 
 	convList=[int,float,float,float,float,float,float,float,float,float,float,float,float,int]
 
+	unpacker=Struct("<BffffffffffffI")
+
+	direction="telemetry"
+
+	deadband={}
+	heartbeat=None
+	precision={}
+
 # message name: housekeepingADCS code: 22
 class housekeepingADCS(Structure):
 	def __init__(self):
@@ -65,6 +82,14 @@ class housekeepingADCS(Structure):
 
 	convList=[int,float,int,float,int,int]
 
+	unpacker=Struct("<B8f8H5f5HI")
+
+	direction="telemetry"
+
+	deadband={'temperature': {'abs': 0.1}, 'temperatureRAW': {'abs': 2}, 'current': {'rel': 0.01}, 'currentRAW': {'abs': 2}}
+	heartbeat=60
+	precision={'temperature': 4, 'current': 4}
+
 # message name: setOpmodeADCS code: 0
 class setOpmodeADCS(Structure):
 	def __init__(self):
@@ -80,6 +105,14 @@ class setOpmodeADCS(Structure):
 
 	convList=[int,int]
 
+	unpacker=Struct("<BB")
+
+	direction="command"
+
+	deadband={}
+	heartbeat=None
+	precision={}
+
 # message name: setAttitudeADCS code: 1
 class setAttitudeADCS(Structure):
 	def __init__(self):
@@ -103,6 +136,14 @@ class setAttitudeADCS(Structure):
 
 	convList=[int,float,float,float,float,float,float,float,float,float]
 
+	unpacker=Struct("<Bfffffffff")
+
+	direction="command"
+
+	deadband={}
+	heartbeat=None
+	precision={}
+
 # messages dictionary (keys are the codes)
 # can be used to instantiate class from msg code
 msgDict={
@@ -113,6 +154,19 @@ msgDict={
 1:setAttitudeADCS
 }
 
+# lines dictionary (keys are the line names)
+# lists the code ranges carried by each line
+lineDict={'ADCS': [(0, 31)]}
+
+# returns the name of the line carrying a message code
+# (None if no line declares it)
+def lineOf(code):
+	for line in lineDict.keys():
+		for first,last in lineDict[line]:
+			if first<=code<=last:
+				return line
+	return None
+
 # String parsing function, this can be used to fill and return a
 # structure class from a string, this string should
 # contain each structure element value separated by spaces
@@ -6,127 +6,193 @@ jsonFile="messages.json"
 PyFile="messages.py"
 CFile="messages.h"
 
-print("--- MESSAGES PARSER ---")
+#writes the python module and the C header generated from the
+#messages dictionary y (loaded from messages.json) on the pyheader
+#and cheader file objects, returns the number of errors found
+def writeMessages(y,pyheader,cheader):
+	errors=0
 
-print("Reading {0}".format(jsonFile))
-#opening messages file
-msgfile=open("messages.json","r")
+	#extracting C types dictionary
+	CTypesDict=y["C types"]
 
-#loading json into dictionary
-y=json.load(msgfile)
+	#extracting Py types dictionary
+	PyTypesDict=y["Py types"]
 
-#extracting C types dictionary
-CTypesDict=y["C types"]
+	#extracting struct types dictionary
+	StructTypesDict=y["Struct types"]
 
-#extracting Py types dictionary
-PyTypesDict=y["Py types"]
+	#extracting messages dictionary
+	messages=y["messages"]
 
-#extracting messages dictionary
-messages=y["messages"]
+	#extracting lines dictionary (optional)
+	lines=y.get("lines",{})
 
-print("Creating {0} and {1}".format(PyFile,CFile))
 
-#opening C header file
-cheader=open("messages.h","w")
-#opening python structure classes file
-pyheader=open("messages.py","w")
+	#header/module headers
+	cheader.write("#ifndef MESSAGES_H\n#define MESSAGES_H\n")
+	cheader.write("\n/*\n Automatically generated by parseMessages.py\n from messages.json\n*/\n\n")
+	cheader.write("#include <stdint.h>\n\n")
+	pyheader.write("# Automatically generated by parseMessages.py\n# from messages.json\n\n")
+	pyheader.write("from ctypes import *\n")
+	pyheader.write("from struct import Struct\n")
+	pyheader.write("import shlex\n\n")
 
-print("Writing files")
+	#printing messages structs/classes
+	for msg in messages.keys():
 
-#header/module headers
-cheader.write("#ifndef MESSAGES_H\n#define MESSAGES_H\n")
-cheader.write("\n/*\n Automatically generated by parseMessages.py\n from messages.json\n*/\n\n")
-cheader.write("#include <stdint.h>\n\n")
-pyheader.write("# Automatically generated by parseMessages.py\n# from messages.json\n\n")
-pyheader.write("from ctypes import *\n")
-pyheader.write("import shlex\n\n")
+		#string used for __str__ function definition
+		strstring=""
+	
+		#string used for type conversion list building
+		typeListStr=""
 
-#printing messages structs/classes
-for msg in messages.keys():
+		#struct format of the message (packed, little endian)
+		structStr="<"+StructTypesDict["c_uint8"]
 
-	#string used for __str__ function definition
-	strstring=""
-	
-	#string used for type conversion list building
-	typeListStr=""
-
-	cheader.write("// message name: {0} code: {1}\n".format(msg,messages[msg]["code"]))
-	cheader.write("#define {0}_CODE {1}\n".format(msg.upper(),messages[msg]["code"]))
-	pyheader.write("# message name: {0} code: {1}\n".format(msg,messages[msg]["code"]))
-	cheader.write("typedef struct {\n")
-	pyheader.write("class {0}(Structure):\n".format(msg))
-	pyheader.write("\tdef __init__(self):\n\t\tsuper().__init__()\n\t\tself.code={0}\n\n".format(messages[msg]["code"]))
-	pyheader.write("\t_pack_=1\n")
-	pyheader.write("\t_fields_=[")
-	currtype=""
-	try:
-		currType=CTypesDict["c_uint8"]
-	except:
-		print("ERROR! c_uint8 type not defined for code of {0}".format(msg))
+		cheader.write("// message name: {0} code: {1}\n".format(msg,messages[msg]["code"]))
+		cheader.write("#define {0}_CODE {1}\n".format(msg.upper(),messages[msg]["code"]))
+		pyheader.write("# message name: {0} code: {1}\n".format(msg,messages[msg]["code"]))
+		cheader.write("typedef struct {\n")
+		pyheader.write("class {0}(Structure):\n".format(msg))
+		pyheader.write("\tdef __init__(self):\n\t\tsuper().__init__()\n\t\tself.code={0}\n\n".format(messages[msg]["code"]))
+		pyheader.write("\t_pack_=1\n")
+		pyheader.write("\t_fields_=[")
+		currtype=""
+		try:
+			currType=CTypesDict["c_uint8"]
+		except:
+			print("ERROR! c_uint8 type not defined for code of {0}".format(msg))
+			errors+=1
 		
-	cheader.write("\t{0} code;\n".format(currType))
-	pyheader.write('("code",c_uint8)'.format(currType))
+		cheader.write("\t{0} code;\n".format(currType))
+		pyheader.write('("code",c_uint8)'.format(currType))
 		
-	typeListStr+="int,"
+		typeListStr+="int,"
 	
-	if "fields" in messages[msg]:
-		for field in messages[msg]["fields"].keys():
-			typeStr=messages[msg]["fields"][field]
-			elemNum=1
-			typeStrSplit=typeStr.split("*",1)
-			if len(typeStrSplit) != 1:
-				elemNum=typeStrSplit[1]
+		if "fields" in messages[msg]:
+			for field in messages[msg]["fields"].keys():
+				typeStr=messages[msg]["fields"][field]
+				elemNum=1
+				typeStrSplit=typeStr.split("*",1)
+				if len(typeStrSplit) != 1:
+					elemNum=typeStrSplit[1]
 				
-			try:
-				currType=CTypesDict[typeStrSplit[0]]
-				elemNum=int(elemNum)
-				if elemNum<=0:
-					raise Exception("Negative erray elements number")
-			except:
-				print("ERROR!, {0}->{1}->{2} is not a valid type".format(msg,field,typeStr))
-			else:
-				cheader.write("\t{0} {1}".format(currType,field))
-				if elemNum!=1:
-					cheader.write("[{0}];\n".format(elemNum))
+				try:
+					currType=CTypesDict[typeStrSplit[0]]
+					elemNum=int(elemNum)
+					if elemNum<=0:
+						raise Exception("Negative erray elements number")
+				except:
+					print("ERROR!, {0}->{1}->{2} is not a valid type".format(msg,field,typeStr))
+					errors+=1
 				else:
-					cheader.write(";\n".format(elemNum))
-				pyheader.write(',\n\t\t("{0}",{1})'.format(field,typeStr))
-				strstring+=" <{0} {1}>".format(typeStr,field)
-				typeListStr+="{0},".format(PyTypesDict[typeStrSplit[0]])
+					cheader.write("\t{0} {1}".format(currType,field))
+					if elemNum!=1:
+						cheader.write("[{0}];\n".format(elemNum))
+					else:
+						cheader.write(";\n".format(elemNum))
+					pyheader.write(',\n\t\t("{0}",{1})'.format(field,typeStr))
+					strstring+=" <{0} {1}>".format(typeStr,field)
+					typeListStr+="{0},".format(PyTypesDict[typeStrSplit[0]])
+					structStr+="{0}{1}".format(elemNum if elemNum!=1 else "",StructTypesDict[typeStrSplit[0]])
 				
-	cheader.write("}}__attribute__((packed)) {0};\n\n".format(msg))
-	pyheader.write(']\n\n'.format(field,currType))
+		cheader.write("}}__attribute__((packed)) {0};\n\n".format(msg))
+		pyheader.write(']\n\n'.format(field,currType))
 	
-	#defining __str__ function for each class
-	pyheader.write('\tdef __str__(self):\n'.format(field,currType))
-	pyheader.write('\t\treturn "{0}{1}"\n\n'.format(msg,strstring))
-
-	#defining type conversion list for fields
-	typeListStr=typeListStr.rstrip(",")
-	pyheader.write("\tconvList=[{0}]\n\n".format(typeListStr))
-
-cheader.write("#endif")
-
-#printing classes dictionary (code : messageClass)
-pyheader.write("# messages dictionary (keys are the codes)\n")
-pyheader.write("# can be used to instantiate class from msg code\n")
-pyheader.write("msgDict={\n")
-for msg in messages.keys():
-	pyheader.write('{0}:{1}'.format(messages[msg]["code"],msg))
-	if msg!=list(messages.keys())[-1]:
-		pyheader.write(",\n")
-	else:
-		pyheader.write("\n}")
-
-#printing python string parsing function
-pyheader.write("\n\n# String parsing function, this can be used to fill and return a\n")
-pyheader.write("# structure class from a string, this string should\n")
-pyheader.write("# contain each structure element value separated by spaces\n")
-pyheader.write('# array elements should be passed in quotes "el1, el2, el3, ..."\n')
-pyheader.write("# the string should start with the structure name as first element\n")
-pyheader.write("# and the function will return the corresponding filled structure in\n")
-pyheader.write("# case of success or throw an exception in case of failure")
-pyheader.write('''
+		#defining __str__ function for each class
+		pyheader.write('\tdef __str__(self):\n'.format(field,currType))
+		pyheader.write('\t\treturn "{0}{1}"\n\n'.format(msg,strstring))
+
+		#defining type conversion list for fields
+		typeListStr=typeListStr.rstrip(",")
+		pyheader.write("\tconvList=[{0}]\n\n".format(typeListStr))
+
+		#defining struct used to decode the message into a flat tuple of values
+		pyheader.write('\tunpacker=Struct("{0}")\n\n'.format(structStr))
+
+		#defining the direction of the message (telemetry from a board or command to a board)
+		direction=messages[msg].get("direction",None)
+		if direction not in ["telemetry","command"]:
+			print("ERROR!, {0}->direction must be telemetry or command".format(msg))
+			errors+=1
+		pyheader.write('\tdirection="{0}"\n\n'.format(direction))
+
+		#defining deadband thresholds ({field: {"abs"/"rel": threshold}}) and heartbeat
+		deadband=messages[msg].get("deadband",{})
+		for field in deadband.keys():
+			if field not in messages[msg].get("fields",{}) or not set(deadband[field].keys())<={"abs","rel"}:
+				print("ERROR!, {0}->deadband->{1} is not a valid deadband".format(msg,field))
+				errors+=1
+		pyheader.write("\tdeadband={0}\n".format(repr(deadband)))
+		pyheader.write("\theartbeat={0}\n".format(messages[msg].get("heartbeat",None)))
+
+		#defining float fields precision ({field: significant digits})
+		precision=messages[msg].get("precision",{})
+		for field in precision.keys():
+			fieldType=messages[msg].get("fields",{}).get(field,"").split("*",1)[0]
+			if PyTypesDict.get(fieldType,None)!="float" or not isinstance(precision[field],int) or not 1<=precision[field]<=9:
+				print("ERROR!, {0}->precision->{1} is not a valid precision".format(msg,field))
+				errors+=1
+		pyheader.write("\tprecision={0}\n\n".format(repr(precision)))
+
+	cheader.write("#endif")
+
+	#printing classes dictionary (code : messageClass)
+	pyheader.write("# messages dictionary (keys are the codes)\n")
+	pyheader.write("# can be used to instantiate class from msg code\n")
+	pyheader.write("msgDict={\n")
+	for msg in messages.keys():
+		pyheader.write('{0}:{1}'.format(messages[msg]["code"],msg))
+		if msg!=list(messages.keys())[-1]:
+			pyheader.write(",\n")
+		else:
+			pyheader.write("\n}")
+
+	#checking the code ranges of the lines
+	ranges=[]
+	for line in lines.keys():
+		for codeRange in lines[line].get("codes",[]):
+			try:
+				first,last=codeRange
+				if not (0<=first<=last<=255) or not isinstance(first,int) or not isinstance(last,int):
+					raise Exception
+			except:
+				print("ERROR! {0} is not a valid code range for line {1}".format(codeRange,line))
+				errors+=1
+				continue
+			for other in ranges:
+				if first<=other[2] and other[1]<=last:
+					print("ERROR! codes {0}-{1} of line {2} overlap codes {3}-{4} of line {5}".format(first,last,line,other[1],other[2],other[0]))
+					errors+=1
+			ranges.append((line,first,last))
+	if lines:
+		for msg in messages.keys():
+			if not any(first<=messages[msg]["code"]<=last for _,first,last in ranges):
+				print("ERROR! code {0} of {1} is not carried by any line".format(messages[msg]["code"],msg))
+				errors+=1
+
+	#printing lines dictionary (line name : code ranges)
+	pyheader.write("\n\n# lines dictionary (keys are the line names)\n")
+	pyheader.write("# lists the code ranges carried by each line\n")
+	pyheader.write("lineDict={0}\n\n".format(repr({line:[(first,last) for l,first,last in ranges if l==line] for line in lines.keys()})))
+	pyheader.write("# returns the name of the line carrying a message code\n")
+	pyheader.write("# (None if no line declares it)\n")
+	pyheader.write('''def lineOf(code):
+	for line in lineDict.keys():
+		for first,last in lineDict[line]:
+			if first<=code<=last:
+				return line
+	return None''')
+
+	#printing python string parsing function
+	pyheader.write("\n\n# String parsing function, this can be used to fill and return a\n")
+	pyheader.write("# structure class from a string, this string should\n")
+	pyheader.write("# contain each structure element value separated by spaces\n")
+	pyheader.write('# array elements should be passed in quotes "el1, el2, el3, ..."\n')
+	pyheader.write("# the string should start with the structure name as first element\n")
+	pyheader.write("# and the function will return the corresponding filled structure in\n")
+	pyheader.write("# case of success or throw an exception in case of failure")
+	pyheader.write('''
 def parseStruct(str):
 
 	args=shlex.split(str)
@@ -161,7 +227,31 @@ def parseStruct(str):
 		raise Exception
 ''')
 
-pyheader.close()
-cheader.close()
+	return errors
+
+if __name__=="__main__":
+	print("--- MESSAGES PARSER ---")
+
+	print("Reading {0}".format(jsonFile))
+	#opening messages file
+	msgfile=open(jsonFile,"r")
+
+	#loading json into dictionary
+	y=json.load(msgfile)
+	msgfile.close()
+
+	print("Creating {0} and {1}".format(PyFile,CFile))
+
+	#opening C header file
+	cheader=open(CFile,"w")
+	#opening python structure classes file
+	pyheader=open(PyFile,"w")
+
+	print("Writing files")
+
+	writeMessages(y,pyheader,cheader)
+
+	pyheader.close()
+	cheader.close()
 
-print("Done.")
+	print("Done.")
@@ -0,0 +1,92 @@
+#Runtime loader for messages.json, it builds in memory the same module
+#that parseMessages.py writes on messages.py (message classes, msgDict
+#and parseStruct) so the daemon can pick up new messages without
+#regenerating files and restarting the service.
+
+#The generated source is cached in cacheDir keyed by the hash of the
+#schema file and by the hash of parseMessages.py (so a changed generator
+#never loads a module generated by an older one), python then also caches
+#its bytecode, so a restart with an unchanged schema only has to import
+#an already compiled module. If cacheDir can't be written (read-only
+#filesystem) the module is built in memory at every load.
+
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+import types
+
+import parseMessages
+
+cacheDir=os.path.join(os.path.dirname(os.path.abspath(__file__)),"__schemacache__")
+hashLen=16 #number of hex digits of the schema hash used for cache naming
+generatorHashLen=8 #number of hex digits of the parseMessages.py hash used for cache naming
+
+#hash of the generator source, part of the cache key
+with open(parseMessages.__file__,"rb") as f:
+	generatorHash=hashlib.sha256(f.read()).hexdigest()[:generatorHashLen]
+
+#loads the schema at jsonPath and returns (module, info), where module
+#has the same interface of messages.py and info is a dictionary with
+#the schema hash, whether the cache was hit and the load time in ms,
+#raises an exception if the schema is not valid
+def loadSchema(jsonPath):
+	startt=time.perf_counter()
+
+	with open(jsonPath,"rb") as f:
+		raw=f.read()
+
+	schemaHash=hashlib.sha256(raw).hexdigest()[:hashLen]
+	modName="messages_{0}_{1}".format(schemaHash,generatorHash)
+	modPath=os.path.join(cacheDir,modName+".py")
+
+	cached=os.path.exists(modPath)
+	source=None
+	if not cached:
+		y=json.loads(raw)
+		pyheader=io.StringIO()
+		errors=parseMessages.writeMessages(y,pyheader,io.StringIO())
+		if errors:
+			raise Exception("{0} errors found in {1}".format(errors,jsonPath))
+		source=pyheader.getvalue()
+
+		#writing to a temporary file and renaming it so that a
+		#concurrent load never sees a partially written module
+		tmpPath="{0}.{1}.tmp".format(modPath,os.getpid())
+		try:
+			os.makedirs(cacheDir,exist_ok=True)
+			with open(tmpPath,"w") as f:
+				f.write(source)
+			os.replace(tmpPath,modPath)
+		except OSError as e:
+			print("WARNING: cannot write the schema cache in {0} ({1}), loading the schema in memory".format(cacheDir,e))
+			try:
+				os.remove(tmpPath)
+			except OSError:
+				pass
+		else:
+			source=None
+
+	#the same schema could be already imported (reload of an unchanged file)
+	if modName in sys.modules:
+		module=sys.modules[modName]
+	elif source is not None: #cache not writable
+		module=types.ModuleType(modName)
+		exec(compile(source,"<{0}>".format(modName),"exec"),module.__dict__)
+		sys.modules[modName]=module
+	else:
+		spec=importlib.util.spec_from_file_location(modName,modPath)
+		module=importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(module)
+		sys.modules[modName]=module
+
+	info={
+		"hash":schemaHash,
+		"cached":cached,
+		"loadTime":(time.perf_counter()-startt)*1000
+	}
+
+	return module,info
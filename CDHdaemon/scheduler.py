@@ -0,0 +1,163 @@
+#Time-tagged command scheduler
+
+#Commands are validated and packed once when they're submitted, then kept
+#in a priority queue ordered by their due time (CLOCK_REALTIME ns) until
+#the CDH thread dispatches them on the serial line.
+#The queue is saved on persistPath at every change (written on a temporary
+#file and renamed) so it survives daemon restarts, commands found late
+#by more than maxLate seconds when they're due (daemon was not running)
+#are discarded instead of being sent. A saved queue which can't be read
+#is renamed (persistPath.bad) and the daemon starts with an empty one.
+#The queue is shared by the CDH threads of all serial lines, each one
+#takes only its own commands (passing an accept function on the entries),
+#commands late by more than maxLate are discarded by any of them, so the
+#ones no line takes anymore (schema or lines changed) don't stay forever.
+
+import heapq
+import json
+import os
+import threading
+import time
+
+import diagLog
+import latency
+
+class CommandScheduler:
+	def __init__(self,persistPath,maxLate):
+		self.persistPath=persistPath
+		self.maxLate=maxLate
+		self.heap=[] #(due ns, id, packed message, command string)
+		self.nextId=1
+		self.jitter=latency.LatencyHistogram("schedJitter") #dispatch time - due time
+		self.lock=threading.Lock() #the queue is used by the client thread and by the CDH threads
+
+		#counters
+		self.sent=0
+		self.failed=0
+		self.expired=0
+
+		self.load()
+
+	def load(self):
+		try:
+			with open(self.persistPath,"r") as f:
+				saved=json.load(f)
+			heap=[(int(entry["due"]),int(entry["id"]),bytes.fromhex(entry["payload"]),str(entry["command"])) for entry in saved["commands"]]
+			nextId=int(saved["nextId"])
+		except FileNotFoundError:
+			return
+		except Exception as e:
+			diagLog.error("Failed to load scheduled commands from {0} ({1}: {2}), starting with an empty queue",self.persistPath,type(e).__name__,e)
+			#keeping the file for inspection, the next save would overwrite it
+			try:
+				os.replace(self.persistPath,self.persistPath+".bad")
+				diagLog.error("Unreadable scheduled commands moved to {0}",self.persistPath+".bad")
+			except OSError as e:
+				diagLog.error("Failed to move {0} ({1})",self.persistPath,e)
+			return
+
+		heapq.heapify(heap)
+		self.heap=heap
+		self.nextId=max([nextId]+[entry[1]+1 for entry in heap]) #ids are never reused
+		diagLog.info("Loaded {0} scheduled commands from {1}",len(self.heap),self.persistPath)
+
+	def save(self):
+		saved={
+			"nextId":self.nextId,
+			"commands":[{"due":due,"id":cid,"payload":payload.hex(),"command":cmd} for due,cid,payload,cmd in sorted(self.heap)]
+		}
+		tmpPath=self.persistPath+".tmp"
+		try:
+			with open(tmpPath,"w") as f:
+				json.dump(saved,f)
+			os.replace(tmpPath,self.persistPath)
+		except Exception as e:
+			diagLog.error("Failed to save scheduled commands on {0} ({1})",self.persistPath,e)
+
+	#adds a packed command due at the realtime due (ns), returns its id
+	def add(self,due,payload,cmd):
+		with self.lock:
+			cid=self.nextId
+			self.nextId+=1
+			heapq.heappush(self.heap,(int(due),cid,payload,cmd))
+			self.save()
+		return cid
+
+	#removes a command, returns False if it doesn't exist
+	def cancel(self,cid):
+		with self.lock:
+			for i in range(len(self.heap)):
+				if self.heap[i][1]==cid:
+					self.heap.pop(i)
+					heapq.heapify(self.heap)
+					self.save()
+					return True
+		return False
+
+	#returns the seconds to the next due command accepted by accept(entry)
+	#(all if accept is None), None if there's no such command
+	def timeToNext(self,now,accept=None):
+		with self.lock:
+			if accept is None:
+				due=self.heap[0][0] if self.heap else None
+			else:
+				due=min((entry[0] for entry in self.heap if accept(entry)),default=None)
+		if due is None:
+			return None
+		return max(0,(due-now)/1e9)
+
+	#removes and returns the commands due at now (ns) accepted by
+	#accept(entry) (all if accept is None), dropping the ones which are too
+	#late (also if not accepted: a command no line takes would stay forever)
+	def popDue(self,now,accept=None):
+		due=[]
+		others=[]
+		changed=False
+		with self.lock:
+			while self.heap and self.heap[0][0]<=now:
+				entry=heapq.heappop(self.heap)
+				accepted=accept is None or accept(entry)
+				if now-entry[0]>self.maxLate*1e9:
+					changed=True
+					self.expired+=1
+					diagLog.warning("scheduled command {0} ({1}) expired {2:.1f} s ago{3}, discarded",entry[1],entry[3],(now-entry[0])/1e9,"" if accepted else " (no line took it)")
+				elif not accepted: #command of another line
+					others.append(entry)
+				else:
+					changed=True
+					due.append(entry)
+			for entry in others:
+				heapq.heappush(self.heap,entry)
+			if changed:
+				self.save()
+		return due
+
+	#records the result of a dispatched command sent at sentTime (ns)
+	def dispatched(self,entry,sentTime,ok):
+		self.jitter.add(sentTime-entry[0])
+		if ok:
+			self.sent+=1
+		else:
+			self.failed+=1
+
+	#returns the list of queued commands as text
+	def listing(self):
+		with self.lock:
+			entries=sorted(self.heap)
+		if not entries:
+			return "No scheduled commands\n"
+		outstr="id  due (UTC)                   in (s)  command\n"
+		now=time.time_ns()
+		for due,cid,payload,cmd in entries:
+			outstr+="{0:<3} {1:<27} {2:>7.1f}  {3}\n".format(cid,time.strftime("%Y-%m-%dT%H:%M:%S",time.gmtime(due/1e9))+".{0:03d}Z".format(int(due/1e6)%1000),(due-now)/1e9,cmd)
+		return outstr
+
+	def stats(self):
+		stats={
+			"schedQueued":len(self.heap),
+			"schedSent":self.sent,
+			"schedFailed":self.failed,
+			"schedExpired":self.expired
+		}
+		stats.update(self.jitter.stats())
+		return stats
@@ -3,12 +3,17 @@
 	towards the serial line will be defined to be used with
 	the simpleDataLink library.
 	
-	Two lines will be defined, one is a loopback line which uses
-	a circular buffer to simulate a serial line closed on itself and which
-	can be used for testing purposes.
-	The other is the actual line using the UART peripheral
+	A loopback line is defined, which uses a circular buffer to
+	simulate a serial line closed on itself and which can be used
+	for testing purposes.
+	The actual lines use the UART peripherals, more lines (towards
+	different boards) can be open at the same time, the same lines
+	can run on a pty, a local socket pair or an in-process memory
+	pipe (for simulators, benchmarks and tests).
 */
 
+#define _GNU_SOURCE //for ppoll()
+
 #include "bufferUtils.h"
 #include "simpleDataLink.h"
 #include <stdint.h>
@@ -19,6 +24,19 @@
 #include <unistd.h>
 #include <errno.h>
 #include <time.h>
+#include <poll.h>
+#include <pthread.h>
+#include <string.h>
+#include <sys/socket.h>
+
+#define TICKS_PER_SEC 1000 //sdlTimeTick resolution (milliseconds)
+
+//returns the time of the clock clk in nanoseconds
+static uint64_t clockNs(clockid_t clk){
+	struct timespec ts;
+	clock_gettime(clk,&ts);
+	return (uint64_t)ts.tv_sec*1000000000ULL+ts.tv_nsec;
+}
 
 //get maximum payload length
 uint32_t getMaxLen(){
@@ -78,55 +96,415 @@ uint32_t receiveLoopback(uint8_t* buff, uint32_t len){
 	return retVal;
 }
 
-//UART line -----------------------------------
+//Serial lines ---------------------------------
+//Up to MAX_LINES independent lines (UARTs towards different boards) can
+//be open at the same time, each one has its own transport, settings
+//and simpleDataLink handle and is identified by the index returned when
+//it's opened. Different lines can be used concurrently by different
+//threads (a single line by one thread at a time).
+//simpleDataLink tx/rx callbacks don't take a context argument, so a
+//pair of callbacks is generated for each line index.
+
+//Transports: every line moves bytes through a transport (read, write,
+//wait and close functions), so the framing and ack code runs unchanged on:
+//	- file descriptors: UART tty, pty (the daemon creates the master and
+//	  links the slave to a path) and local socket pairs
+//	- memory pipes: a pair of lines connected in the same process by two
+//	  large ring buffers, without any system call
+//Received bytes are read ahead in blocks and transmitted bytes are
+//buffered until the frame is complete (or an ack is awaited), so no
+//transport does I/O for every byte.
+
+#define UART_DEV "/dev/serial0" //default device name
+#define UART_DEV_MAXLEN 256 //maximum device path length
+#define UART_BAUD 115200 //default baud rate
+#define MAX_LINES 8 //maximum number of lines open at the same time
+#define RX_AHEAD_LEN 4096 //bytes read at once from the transport
+#define TX_BUFF_LEN 4096 //bytes buffered before writing on the transport
+#define TX_TIMEOUT_MS 1000 //maximum time waited for a full transport to accept data
+#define MEM_PIPE_LEN (1<<20) //bytes buffered in each direction of a memory pipe
+
+//one direction of a memory pipe
+typedef struct {
+	uint8_t* data;
+	uint32_t size;
+	uint32_t head; //next byte to read
+	uint32_t count; //bytes waiting to be read
+	uint8_t ends; //ends still open (freed when 0)
+	pthread_mutex_t mutex;
+	pthread_cond_t cond; //signaled when data is written or read
+} mem_pipe;
+
+typedef struct uart_line uart_line;
+
+//transport interface: read and write are non blocking and return the
+//number of bytes moved (-1 on errors, also when the other end was closed
+//or hung up), wait blocks until some data can be read or the timeout
+//expires and returns 1 if data is available, 0 on timeout, -1 if the
+//other end was closed or hung up
+typedef struct {
+	const char* name;
+	int (*read)(uart_line* l, uint8_t* buff, uint32_t len);
+	int (*write)(uart_line* l, const uint8_t* buff, uint32_t len);
+	int (*wait)(uart_line* l, const struct timespec* timeout);
+	void (*close)(uart_line* l);
+} transport;
+
+struct uart_line {
+	uint8_t init; //store that the line was initialized
+	const transport* tr; //transport of the line
+	int fd; //file descriptor (descriptor transports)
+	int slavefd; //pty slave kept open so the master never sees a hang up (-1 if not a pty)
+	char link[UART_DEV_MAXLEN]; //symlink to the pty slave, removed on close
+	mem_pipe* rxPipe; //memory pipe transport
+	mem_pipe* txPipe;
+	uint8_t rxBuff[RX_AHEAD_LEN]; //read-ahead buffer
+	uint32_t rxLen;
+	uint32_t rxPos;
+	uint8_t rxError; //the transport was closed or hung up (the line must be reopened)
+	uint8_t txBuff[TX_BUFF_LEN]; //transmission buffer
+	uint32_t txLen;
+	uint64_t rxLastMono; //CLOCK_MONOTONIC time (ns) of the last bytes received
+	uint64_t rxLastReal; //CLOCK_REALTIME time (ns) of the last bytes received
+	uint64_t frameLastMono; //monotonic timestamp (ns) given to the last frame received
+	uint64_t frameLastReal; //realtime timestamp (ns) given to the last frame received
+	char dev[UART_DEV_MAXLEN]; //device name (used for prints)
+	serial_line_handle line; //simpleDataLink line handle
+};
+
+uart_line lines[MAX_LINES];
+pthread_mutex_t linesMutex=PTHREAD_MUTEX_INITIALIZER; //protects lines allocation
+
+//converts a timeout in seconds (python format) to a timespec
+static struct timespec toTimespec(float timeout){
+	struct timespec ts;
+	if(timeout<0) timeout=0;
+	ts.tv_sec=(time_t)timeout;
+	ts.tv_nsec=(long)((timeout-ts.tv_sec)*1000000000.0f);
+	return ts;
+}
+
+//file descriptor transport
+static int fdRead(uart_line* l, uint8_t* buff, uint32_t len){
+	int n=read(l->fd,buff,len);
+	if(n<0) return (errno==EAGAIN || errno==EWOULDBLOCK) ? 0 : -1;
+	if(n==0) return -1; //end of file: the peer closed the socket or the device hung up
+	return n;
+}
+static int fdWrite(uart_line* l, const uint8_t* buff, uint32_t len){
+	int n=write(l->fd,buff,len);
+	if(n<0) return (errno==EAGAIN || errno==EWOULDBLOCK) ? 0 : -1;
+	return n;
+}
+static int fdWait(uart_line* l, const struct timespec* timeout){
+	struct pollfd pfd={.fd=l->fd, .events=POLLIN};
+	//ppoll has nanoseconds resolution (needed for scheduled commands)
+	int n=ppoll(&pfd,1,timeout,NULL);
+	if(n<0) return errno==EINTR ? 0 : -1;
+	if(n==0) return 0;
+	if(pfd.revents & POLLIN) return 1; //data left before a hang up is read first
+	if(pfd.revents & (POLLHUP|POLLERR|POLLNVAL)) return -1;
+	return 0;
+}
+static void fdClose(uart_line* l){
+	close(l->fd);
+	if(l->slavefd>=0) close(l->slavefd);
+	if(l->link[0]) unlink(l->link);
+}
+static const transport fdTransport={"fd",fdRead,fdWrite,fdWait,fdClose};
+
+//memory pipe transport
+static mem_pipe* memPipeNew(){
+	mem_pipe* p=calloc(1,sizeof(mem_pipe));
+	if(!p) return NULL;
+	p->data=malloc(MEM_PIPE_LEN);
+	if(!p->data){
+		free(p);
+		return NULL;
+	}
+	p->size=MEM_PIPE_LEN;
+	p->ends=2;
+	pthread_mutex_init(&p->mutex,NULL);
+	//waits are measured on the monotonic clock
+	pthread_condattr_t attr;
+	pthread_condattr_init(&attr);
+	pthread_condattr_setclock(&attr,CLOCK_MONOTONIC);
+	pthread_cond_init(&p->cond,&attr);
+	pthread_condattr_destroy(&attr);
+	return p;
+}
+static void memPipeRelease(mem_pipe* p){
+	pthread_mutex_lock(&p->mutex);
+	uint8_t ends=--p->ends;
+	pthread_cond_broadcast(&p->cond);
+	pthread_mutex_unlock(&p->mutex);
+	if(ends==0){
+		pthread_mutex_destroy(&p->mutex);
+		pthread_cond_destroy(&p->cond);
+		free(p->data);
+		free(p);
+	}
+}
+static int memRead(uart_line* l, uint8_t* buff, uint32_t len){
+	mem_pipe* p=l->rxPipe;
+	pthread_mutex_lock(&p->mutex);
+	if(p->count==0 && p->ends<2){ //the other end was closed
+		pthread_mutex_unlock(&p->mutex);
+		return -1;
+	}
+	uint32_t n=p->count<len ? p->count : len;
+	for(uint32_t copied=0;copied<n;){
+		uint32_t chunk=p->size-p->head;
+		if(chunk>n-copied) chunk=n-copied;
+		memcpy(buff+copied,p->data+p->head,chunk);
+		p->head=(p->head+chunk)%p->size;
+		copied+=chunk;
+	}
+	p->count-=n;
+	if(n) pthread_cond_broadcast(&p->cond); //space for a waiting writer
+	pthread_mutex_unlock(&p->mutex);
+	return n;
+}
+static int memWrite(uart_line* l, const uint8_t* buff, uint32_t len){
+	mem_pipe* p=l->txPipe;
+	pthread_mutex_lock(&p->mutex);
+	if(p->ends<2){ //the other end was closed
+		pthread_mutex_unlock(&p->mutex);
+		return -1;
+	}
+	uint32_t space=p->size-p->count;
+	uint32_t n=space<len ? space : len;
+	for(uint32_t copied=0;copied<n;){
+		uint32_t tail=(p->head+p->count)%p->size;
+		uint32_t chunk=p->size-tail;
+		if(chunk>n-copied) chunk=n-copied;
+		memcpy(p->data+tail,buff+copied,chunk);
+		p->count+=chunk;
+		copied+=chunk;
+	}
+	if(n) pthread_cond_broadcast(&p->cond); //data for a waiting reader
+	pthread_mutex_unlock(&p->mutex);
+	return n;
+}
+//waits on pipe p until cond(p) is true or the timeout expires
+static uint8_t memPipeWait(mem_pipe* p, const struct timespec* timeout, uint8_t forSpace){
+	struct timespec deadline;
+	clock_gettime(CLOCK_MONOTONIC,&deadline);
+	deadline.tv_sec+=timeout->tv_sec;
+	deadline.tv_nsec+=timeout->tv_nsec;
+	if(deadline.tv_nsec>=1000000000L){
+		deadline.tv_sec++;
+		deadline.tv_nsec-=1000000000L;
+	}
+	pthread_mutex_lock(&p->mutex);
+	while((forSpace ? p->count==p->size : p->count==0) && p->ends==2){
+		if(pthread_cond_timedwait(&p->cond,&p->mutex,&deadline)==ETIMEDOUT) break;
+	}
+	uint8_t ready=forSpace ? p->count<p->size : p->count>0;
+	pthread_mutex_unlock(&p->mutex);
+	return ready;
+}
+static int memWait(uart_line* l, const struct timespec* timeout){
+	if(memPipeWait(l->rxPipe,timeout,0)) return 1;
+	pthread_mutex_lock(&l->rxPipe->mutex);
+	uint8_t closed=l->rxPipe->ends<2;
+	pthread_mutex_unlock(&l->rxPipe->mutex);
+	return closed ? -1 : 0;
+}
+static void memClose(uart_line* l){
+	memPipeRelease(l->rxPipe);
+	memPipeRelease(l->txPipe);
+}
+static const transport memTransport={"memory pipe",memRead,memWrite,memWait,memClose};
 
-#define UART_DEV "/dev/serial0" //device name
-
-//store that uart line was initialized
-uint8_t uartInit=0;
-int uartfd; //UART file descriptor
-serial_line_handle uartLine; //uart line handle
-
-//defining txFunc and rxFunc for uart line
-uint8_t txFuncUart(uint8_t byte){
-	//temporarily set descriptor as blocking
-	int state=fcntl(uartfd,F_GETFL);
-	fcntl(uartfd,F_SETFL,state & ~O_NONBLOCK);
-	if(write(uartfd,&byte,1) !=1) return 0;
-	//return to blocking
-	fcntl(uartfd,F_SETFL,state);
+//waits until the transport of l can accept more data (timeout in ms)
+static uint8_t waitWritable(uart_line* l, int timeoutMs){
+	if(l->tr==&memTransport){
+		struct timespec ts={timeoutMs/1000,(timeoutMs%1000)*1000000L};
+		return memPipeWait(l->txPipe,&ts,1);
+	}
+	struct pollfd pfd={.fd=l->fd, .events=POLLOUT};
+	return poll(&pfd,1,timeoutMs)>0;
+}
+
+//writes the transmission buffer of l on its transport, returns 0 on failure
+static uint8_t flushLine(uart_line* l){
+	uint32_t sent=0;
+	while(sent<l->txLen){
+		int n=l->tr->write(l,l->txBuff+sent,l->txLen-sent);
+		if(n<0 || (n==0 && !waitWritable(l,TX_TIMEOUT_MS))){
+			l->txLen=0;
+			return 0;
+		}
+		sent+=n;
+	}
+	l->txLen=0;
 	return 1;
 }
-uint8_t rxFuncUart(uint8_t* byte){
-	if(read(uartfd,byte,1)!=1) return 0;
+
+//tx and rx functions of line h
+static uint8_t txFuncLine(int h, uint8_t byte){
+	uart_line* l=&lines[h];
+	if(l->txLen==TX_BUFF_LEN && !flushLine(l)) return 0;
+	l->txBuff[l->txLen++]=byte;
 	return 1;
 }
+static uint8_t rxFuncLine(int h, uint8_t* byte){
+	uart_line* l=&lines[h];
+	if(l->rxPos==l->rxLen){
+		//a frame waiting for its ack has to leave before reading
+		if(l->txLen) flushLine(l);
+		int n=l->tr->read(l,l->rxBuff,RX_AHEAD_LEN);
+		if(n<0) l->rxError=1;
+		if(n<=0) return 0;
+		l->rxLen=n;
+		l->rxPos=0;
+		//stamping every block, when a frame is completed these are the times of its last bytes
+		l->rxLastMono=clockNs(CLOCK_MONOTONIC);
+		l->rxLastReal=clockNs(CLOCK_REALTIME);
+	}
+	*byte=l->rxBuff[l->rxPos++];
+	return 1;
+}
+
+//callbacks of each line index
+#define LINE_FUNCS(n) \
+	static uint8_t txFunc##n(uint8_t byte){ return txFuncLine(n,byte); } \
+	static uint8_t rxFunc##n(uint8_t* byte){ return rxFuncLine(n,byte); }
+LINE_FUNCS(0) LINE_FUNCS(1) LINE_FUNCS(2) LINE_FUNCS(3)
+LINE_FUNCS(4) LINE_FUNCS(5) LINE_FUNCS(6) LINE_FUNCS(7)
+static uint8_t (*txFuncs[MAX_LINES])(uint8_t)={txFunc0,txFunc1,txFunc2,txFunc3,txFunc4,txFunc5,txFunc6,txFunc7};
+static uint8_t (*rxFuncs[MAX_LINES])(uint8_t*)={rxFunc0,rxFunc1,rxFunc2,rxFunc3,rxFunc4,rxFunc5,rxFunc6,rxFunc7};
 
 //defining simpleDalaLink sdlTimeTick function
+//(wall time in milliseconds, clock() would count only the CPU time of the process)
 uint32_t sdlTimeTick(){
-	return (uint32_t) clock();
+	return (uint32_t)(clockNs(CLOCK_MONOTONIC)/(1000000000ULL/TICKS_PER_SEC));
 }
 
-//init function, the timeout (in python format) and number of retries should be passed
-void initUART(float timeout, uint8_t retries){
-	uartfd = open(UART_DEV, O_RDWR | O_NOCTTY | O_NONBLOCK);
-	if(uartfd == -1){
-		printf("ERROR Failed to open %s\n",UART_DEV);
-		return;
+//checks that h is an initialized line
+static uint8_t validLine(int h){
+	if(h<0 || h>=MAX_LINES || !lines[h].init){
+		printf("ERROR! line %d is not initialized, open it with openLine() before use\n",h);
+		return 0;
+	}
+	return 1;
+}
+
+//reserves a free line, returns its index or -1 if all lines are in use
+static int reserveLine(const char* dev){
+	int h=-1;
+	pthread_mutex_lock(&linesMutex);
+	for(int i=0;i<MAX_LINES;i++){
+		if(!lines[i].init && !lines[i].tr){
+			h=i;
+			lines[i].tr=&fdTransport; //reserved
+			break;
+		}
+	}
+	pthread_mutex_unlock(&linesMutex);
+	if(h<0) printf("ERROR, cannot open %s, all %d lines are in use\n",dev,MAX_LINES);
+	return h;
+}
+
+//initializes the reserved line h on the transport tr
+static void initLine(int h, const transport* tr, const char* dev, float timeout, uint8_t retries){
+	uart_line* l=&lines[h];
+	l->tr=tr;
+	l->rxLen=0;
+	l->rxPos=0;
+	l->rxError=0;
+	l->txLen=0;
+	l->rxLastMono=0;
+	l->rxLastReal=0;
+	l->frameLastMono=0;
+	l->frameLastReal=0;
+	snprintf(l->dev,UART_DEV_MAXLEN,"%s",dev);
+	
+	//computing the timeout
+	uint32_t intTimeout=(uint32_t)(timeout*TICKS_PER_SEC);
+	
+	//initializing serial line handle
+	sdlInitLine(&l->line,txFuncs[h],rxFuncs[h],intTimeout,retries);
+	l->init=1;
+	
+	printf("%s correctly initialized (line %d, %s transport)\n",dev,h,tr->name);
+}
+
+//opens a line on the file descriptor fd, returns the line index or -1
+static int openFdLine(int fd, int slavefd, const char* link, const char* dev, float timeout, uint8_t retries){
+	int h=reserveLine(dev);
+	if(h<0) return -1;
+	
+	//setting descriptor as non blocking, as the transport expects
+	int state=fcntl(fd,F_GETFL);
+	fcntl(fd,F_SETFL,state | O_NONBLOCK);
+	
+	lines[h].fd=fd;
+	lines[h].slavefd=slavefd;
+	snprintf(lines[h].link,UART_DEV_MAXLEN,"%s",link ? link : "");
+	initLine(h,&fdTransport,dev,timeout,retries);
+	return h;
+}
+
+//returns the termios speed of a baud rate (0 if not supported)
+static speed_t baudSpeed(uint32_t baud){
+	switch(baud){
+		case 9600: return B9600;
+		case 19200: return B19200;
+		case 38400: return B38400;
+		case 57600: return B57600;
+		case 115200: return B115200;
+		case 230400: return B230400;
+		case 460800: return B460800;
+		case 500000: return B500000;
+		case 921600: return B921600;
+		case 1000000: return B1000000;
+		case 2000000: return B2000000;
+		case 3000000: return B3000000;
+		case 4000000: return B4000000;
+		default: return 0;
+	}
+}
+
+//opens a line on an already opened file descriptor (for example a pty
+//master or a socket, used by the ADCS simulator), the descriptor is not
+//configured, the timeout (in python format) and number of retries should be passed,
+//returns the line index or -1 in case of failure
+int openLineFd(int fd, float timeout, uint8_t retries){
+	char dev[UART_DEV_MAXLEN];
+	snprintf(dev,UART_DEV_MAXLEN,"fd %d",fd);
+	return openFdLine(fd,-1,NULL,dev,timeout,retries);
+}
+
+//opens a line on the tty device dev with the given baud rate, the timeout
+//(in python format) and number of retries should be passed,
+//returns the line index or -1 in case of failure
+int openLine(char* dev, uint32_t baud, float timeout, uint8_t retries){
+	speed_t speed=baudSpeed(baud);
+	if(!speed){
+		printf("ERROR, baud rate %u not supported for %s\n",baud,dev);
+		return -1;
 	}
 	
-	if(!isatty(uartfd)){
-		printf("ERROR, %s is not a tty device\n",UART_DEV);
-		close(uartfd);
-		return;
+	int fd = open(dev, O_RDWR | O_NOCTTY | O_NONBLOCK);
+	if(fd == -1){
+		printf("ERROR Failed to open %s\n",dev);
+		return -1;
+	}
+	
+	if(!isatty(fd)){
+		printf("ERROR, %s is not a tty device\n",dev);
+		close(fd);
+		return -1;
 	}
 	
 	struct termios config;
 	
-	if(tcgetattr(uartfd, &config) < 0){
-		printf("ERROR, cannot get %s configuration\n",UART_DEV);
-		close(uartfd);
-		return;
+	if(tcgetattr(fd, &config) < 0){
+		printf("ERROR, cannot get %s configuration\n",dev);
+		close(fd);
+		return -1;
 	}
 	
 	//setting input flags
@@ -158,56 +536,207 @@ void initUART(float timeout, uint8_t retries){
 	config.c_cc[VMIN]=1;
 	
 	//setting baud rate
-	if(cfsetispeed(&config, B115200) < 0 || cfsetospeed(&config, B115200) < 0){
-		printf("ERROR, cannot set %s baud rate\n",UART_DEV);
-		close(uartfd);
-		return;
+	if(cfsetispeed(&config, speed) < 0 || cfsetospeed(&config, speed) < 0){
+		printf("ERROR, cannot set %s baud rate\n",dev);
+		close(fd);
+		return -1;
 	}
 	
 	//apply configuration
-	if(tcsetattr(uartfd, TCSAFLUSH, &config) < 0){
-		printf("ERROR, cannot set %s configuration\n",UART_DEV);
-		close(uartfd);
-		return;
+	if(tcsetattr(fd, TCSAFLUSH, &config) < 0){
+		printf("ERROR, cannot set %s configuration\n",dev);
+		close(fd);
+		return -1;
 	}
 	
-	//computing the timeout
-	uint32_t intTimeout=(uint32_t)(timeout*CLOCKS_PER_SEC);
-	
-	//initializing serial line handle
-	sdlInitLine(&uartLine,&txFuncUart,&rxFuncUart,intTimeout,retries);
+	return openFdLine(fd,-1,NULL,dev,timeout,retries);
+}
+
+//creates a pseudo-terminal and opens a line on its master side, the
+//slave (in raw mode) is linked to the path link so that a board
+//simulator can open it like a UART, the link is removed when the line
+//is closed, returns the line index or -1 in case of failure
+int openLinePty(char* link, float timeout, uint8_t retries){
+	int fd=posix_openpt(O_RDWR | O_NOCTTY);
+	if(fd == -1 || grantpt(fd) < 0 || unlockpt(fd) < 0){
+		printf("ERROR, cannot create a pty for %s\n",link);
+		if(fd != -1) close(fd);
+		return -1;
+	}
+	char* slaveName=ptsname(fd);
+	int slavefd=slaveName ? open(slaveName, O_RDWR | O_NOCTTY) : -1;
+	if(slavefd == -1){
+		printf("ERROR, cannot open the pty slave for %s\n",link);
+		close(fd);
+		return -1;
+	}
+	struct termios config;
+	if(tcgetattr(slavefd, &config) == 0){
+		cfmakeraw(&config);
+		tcsetattr(slavefd, TCSANOW, &config);
+	}
 	
-	//signal that UART was correctly initialized
-	printf("%s correctly initialized\n",UART_DEV);
+	unlink(link); //replacing the link of a previous run
+	if(symlink(slaveName,link) < 0){
+		printf("ERROR, cannot link %s to %s\n",link,slaveName);
+		close(slavefd);
+		close(fd);
+		return -1;
+	}
 	
-	uartInit=1;
-	return;
+	char dev[UART_DEV_MAXLEN];
+	snprintf(dev,UART_DEV_MAXLEN,"pty %s -> %s",link,slaveName);
+	return openFdLine(fd,slavefd,link,dev,timeout,retries);
 }
 
-void deinitUART(){
-	close(uartfd);
-	printf("%s correctly de-initialized\n",UART_DEV);
-	uartInit=0;
-	return;
+void closeLine(int h);
+
+//opens two lines connected to each other, with kind 0 through a memory
+//pipe (in process, no system calls), with kind 1 through a local socket
+//pair, the timeout (in python format) and number of retries are the same
+//for both lines, returns the index of the first line and writes the
+//index of the other one (the peer) in peer, -1 in case of failure
+int openLinePair(uint8_t kind, float timeout, uint8_t retries, int* peer){
+	if(kind==1){
+		int fds[2];
+		if(socketpair(AF_UNIX,SOCK_STREAM,0,fds) < 0){
+			printf("ERROR, cannot create a socket pair\n");
+			return -1;
+		}
+		int h=openFdLine(fds[0],-1,NULL,"socket pair",timeout,retries);
+		int p=h<0 ? -1 : openFdLine(fds[1],-1,NULL,"socket pair peer",timeout,retries);
+		if(p<0){
+			if(h>=0) closeLine(h); else close(fds[0]);
+			close(fds[1]);
+			return -1;
+		}
+		*peer=p;
+		return h;
+	}
 	
+	mem_pipe* ab=memPipeNew();
+	mem_pipe* ba=memPipeNew();
+	int h=(ab && ba) ? reserveLine("memory pipe") : -1;
+	int p=h<0 ? -1 : reserveLine("memory pipe peer");
+	if(p<0){
+		printf("ERROR, cannot create a memory pipe\n");
+		if(h>=0) lines[h].tr=NULL;
+		if(ab){ ab->ends=1; memPipeRelease(ab); }
+		if(ba){ ba->ends=1; memPipeRelease(ba); }
+		return -1;
+	}
+	lines[h].txPipe=ab;
+	lines[h].rxPipe=ba;
+	lines[p].txPipe=ba;
+	lines[p].rxPipe=ab;
+	initLine(h,&memTransport,"memory pipe",timeout,retries);
+	initLine(p,&memTransport,"memory pipe peer",timeout,retries);
+	*peer=p;
+	return h;
 }
 
-uint8_t sendUART(uint8_t* buff, uint32_t len, uint8_t ackWanted){
-	if(!uartInit){
-		printf("ERROR! initialize uart line with initUART() before use\n");
-		return 0;
-	}
-	uint8_t retVal=sdlSend(&uartLine,buff,len, ackWanted);
+void closeLine(int h){
+	if(h<0 || h>=MAX_LINES || !lines[h].init) return;
+	pthread_mutex_lock(&linesMutex);
+	lines[h].tr->close(&lines[h]);
+	lines[h].init=0;
+	lines[h].tr=NULL;
+	pthread_mutex_unlock(&linesMutex);
+	printf("%s correctly de-initialized\n",lines[h].dev);
+}
+
+uint8_t sendLine(int h, uint8_t* buff, uint32_t len, uint8_t ackWanted){
+	if(!validLine(h)) return 0;
+	uint8_t retVal=sdlSend(&lines[h].line,buff,len,ackWanted);
+	//writing what's left of the frame (all of it if no ack was requested)
+	if(lines[h].txLen && !flushLine(&lines[h])) return 0;
 	return retVal;
 }
 
-uint32_t receiveUART(uint8_t* buff, uint32_t len){
-	if(!uartInit){
-		printf("ERROR! initialize uart line with initUART() before use\n");
-		return 0;
+//receives a frame from line h, also returning the monotonic and realtime
+//timestamps (ns) of the arrival of its last bytes (mono and real can be NULL),
+//returns the frame length, 0 if no frame is available, -1 if the other end
+//of the line was closed or hung up (the line has to be closed and reopened),
+//timestamps are strictly increasing on each line: frames completed in the
+//same read-ahead block would share its time (and the realtime one is the
+//line protocol timestamp, so InfluxDB would keep only one of them), the
+//following ones get 1 ns more than the previous frame
+int receiveLine(int h, uint8_t* buff, uint32_t len, uint64_t* mono, uint64_t* real){
+	if(!validLine(h)) return 0;
+	uart_line* l=&lines[h];
+	int retVal=sdlReceive(&l->line,buff,len);
+	//acks are written immediately
+	if(l->txLen) flushLine(l);
+	if(!retVal && l->rxError) return -1;
+	if(retVal){
+		l->frameLastMono=l->rxLastMono>l->frameLastMono ? l->rxLastMono : l->frameLastMono+1;
+		l->frameLastReal=l->rxLastReal>l->frameLastReal ? l->rxLastReal : l->frameLastReal+1;
+		if(mono) *mono=l->frameLastMono;
+		if(real) *real=l->frameLastReal;
 	}
-	uint8_t retVal=sdlReceive(&uartLine,buff,len);
 	return retVal;
 }
 
+//waits up to timeout seconds (python format) for some data on line h,
+//returns 1 if data is available, 0 otherwise, -1 if the other end of the
+//line was closed or hung up (receiveLine returns -1 too from then on)
+int waitLine(int h, float timeout){
+	if(h<0 || h>=MAX_LINES || !lines[h].init) return 0;
+	uart_line* l=&lines[h];
+	if(l->rxPos<l->rxLen) return 1; //already read ahead
+	if(l->rxError) return -1;
+	struct timespec ts=toTimespec(timeout);
+	int retVal=l->tr->wait(l,&ts);
+	if(retVal<0) l->rxError=1;
+	return retVal;
+}
 
+//UART line -----------------------------------
+//single line interface, kept for the tools using one line only
+//(it works on the line opened by the last initUART call)
+
+int uartLine=-1; //index of the uart line
+
+//init function on an already opened file descriptor, the timeout
+//(in python format) and number of retries should be passed
+void initUARTfd(int fd, float timeout, uint8_t retries){
+	uartLine=openLineFd(fd,timeout,retries);
+}
+
+//init function on the tty device dev, the timeout (in python format)
+//and number of retries should be passed
+void initUARTDev(char* dev, float timeout, uint8_t retries){
+	uartLine=openLine(dev,UART_BAUD,timeout,retries);
+}
+
+//init function on the default UART device, the timeout (in python format) and number of retries should be passed
+void initUART(float timeout, uint8_t retries){
+	initUARTDev(UART_DEV,timeout,retries);
+}
+
+void deinitUART(){
+	closeLine(uartLine);
+	uartLine=-1;
+}
+
+uint8_t sendUART(uint8_t* buff, uint32_t len, uint8_t ackWanted){
+	return sendLine(uartLine,buff,len,ackWanted);
+}
+
+uint32_t receiveUART(uint8_t* buff, uint32_t len){
+	int retVal=receiveLine(uartLine,buff,len,NULL,NULL);
+	return retVal<0 ? 0 : retVal;
+}
+
+//same as receiveUART, but also returns the monotonic and realtime
+//timestamps (ns) of the arrival of the last byte of the frame
+uint32_t receiveUARTStamped(uint8_t* buff, uint32_t len, uint64_t* mono, uint64_t* real){
+	int retVal=receiveLine(uartLine,buff,len,mono,real);
+	return retVal<0 ? 0 : retVal;
+}
+
+//waits up to timeout seconds (python format) for some data on the uart line,
+//returns 1 if data is available, 0 otherwise
+uint8_t waitUART(float timeout){
+	return waitLine(uartLine,timeout)!=0;
+}
@@ -0,0 +1,164 @@
+#!/bin/python3
+
+#this script measures the serial communication structure
+#(simpleDataLink framing and acks of serialInterface.c) on
+#every transport: memory pipe, socket pair, pty and,
+#if two connected UART devices are given, a real UART
+
+#for each transport two connected lines are opened, then
+#frames are streamed without ack (one thread sending, one
+#receiving) and sent one at a time with ack (round trips),
+#checking that every frame is delivered intact and that the
+#timestamps of the frames received on a line are strictly
+#increasing (they're the line protocol timestamps)
+
+#with the transports connecting two lines (mem and socket) one
+#end is then closed, checking that the other one reports it
+#(instead of waking up forever with nothing to read)
+
+#Examples:
+#	./testTransports.py
+#	./testTransports.py --frames 2000 --size 64 --uart /dev/ttyUSB0 /dev/ttyUSB1
+
+from ctypes import *
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+parser=argparse.ArgumentParser(description="Serial transports benchmark")
+parser.add_argument("--frames",type=int,default=20000,help="frames streamed without ack")
+parser.add_argument("--ack-frames",type=int,default=2000,help="frames sent with ack")
+parser.add_argument("--size",type=int,default=40,help="frame payload size (bytes)")
+parser.add_argument("--transports",default="mem,socket,pty",help="comma separated transports to measure")
+parser.add_argument("--uart",nargs=2,metavar="DEV",help="two UART devices connected to each other")
+parser.add_argument("--baud",type=int,default=115200,help="UART baud rate")
+parser.add_argument("--timeout",type=float,default=0.1,help="ack timeout (s)")
+parser.add_argument("--retries",type=int,default=2,help="ack retries")
+args=parser.parse_args()
+
+serial = CDLL(os.path.join(os.path.dirname(os.path.abspath(__file__)),"serialInterface.so"))
+size=min(args.size,serial.getMaxLen())
+
+#opens two connected lines on a transport, returns their indexes
+def openPair(transport):
+	timeout=c_float(args.timeout)
+	retries=c_uint8(args.retries)
+	if transport in ["mem","socket"]:
+		peer=c_int(-1)
+		a=serial.openLinePair(0 if transport=="mem" else 1,timeout,retries,byref(peer))
+		return a,peer.value
+	if transport=="pty":
+		link=os.path.join(tempfile.mkdtemp(prefix="testTransports_"),"pty")
+		a=serial.openLinePty(link.encode("utf-8"),timeout,retries)
+		b=serial.openLine(link.encode("utf-8"),args.baud,timeout,retries) if a>=0 else -1
+		return a,b
+	if transport=="uart":
+		a=serial.openLine(args.uart[0].encode("utf-8"),args.baud,timeout,retries)
+		b=serial.openLine(args.uart[1].encode("utf-8"),args.baud,timeout,retries)
+		return a,b
+	return -1,-1
+
+def frame(i):
+	return bytes((i+y)&0xFF for y in range(size))
+
+#receives up to n frames on line h (until idleTimeout without data),
+#returns the number of frames received intact
+class receiver(threading.Thread):
+	def __init__(self,h,n,idleTimeout=1):
+		super().__init__(daemon=True)
+		self.h=h
+		self.n=n
+		self.idleTimeout=idleTimeout
+		self.received=0
+		self.corrupted=0
+		self.stampsNotIncreasing=0 #frames with a timestamp not after the previous one
+
+	def run(self):
+		buffrx=create_string_buffer(serial.getMaxLen())
+		mono=c_uint64(0)
+		real=c_uint64(0)
+		lastMono=0
+		lastReal=0
+		lastRx=time.monotonic()
+		while self.received+self.corrupted<self.n and time.monotonic()-lastRx<self.idleTimeout:
+			if not serial.waitLine(self.h,c_float(0.05)):
+				continue
+			while 1:
+				l=serial.receiveLine(self.h,buffrx,len(buffrx),byref(mono),byref(real))
+				if l<=0:
+					break
+				lastRx=time.monotonic()
+				if mono.value<=lastMono or real.value<=lastReal:
+					self.stampsNotIncreasing+=1
+				lastMono=mono.value
+				lastReal=real.value
+				if string_at(buffrx,l)==frame(self.received+self.corrupted):
+					self.received+=1
+				else:
+					self.corrupted+=1
+
+def measure(transport):
+	a,b=openPair(transport)
+	if a<0 or b<0:
+		print("{0:<8} could not be opened".format(transport))
+		return True
+	frames=[frame(i) for i in range(max(args.frames,args.ack_frames))]
+	testPass=True
+
+	#streaming without ack
+	rx=receiver(b,args.frames)
+	rx.start()
+	startt=time.monotonic()
+	for i in range(args.frames):
+		serial.sendLine(a,frames[i],size,0)
+	rx.join()
+	dt=time.monotonic()-startt
+	print("{0:<8} no ack: {1:>6} of {2} frames in {3:6.3f} s, {4:>9.0f} frames/s {5:>7.2f} MB/s, {6} corrupted, {7} timestamps not increasing".format(transport,rx.received,args.frames,dt,rx.received/dt,rx.received*size/dt/1e6,rx.corrupted,rx.stampsNotIncreasing))
+	testPass=testPass and rx.received==args.frames and rx.stampsNotIncreasing==0
+
+	#round trips with ack
+	rx=receiver(b,args.ack_frames)
+	rx.start()
+	acked=0
+	startt=time.monotonic()
+	for i in range(args.ack_frames):
+		acked+=serial.sendLine(a,frames[i],size,1)!=0
+	dt=time.monotonic()-startt
+	rx.join()
+	print("{0:<8} ack:    {1:>6} of {2} frames acked in {3:6.3f} s, {4:>9.0f} frames/s, {5:7.1f} us per round trip, {6} corrupted, {7} timestamps not increasing".format(transport,acked,args.ack_frames,dt,acked/dt,1e6*dt/max(1,acked),rx.corrupted,rx.stampsNotIncreasing))
+	testPass=testPass and acked==args.ack_frames and rx.received==args.ack_frames and rx.stampsNotIncreasing==0
+
+	if transport in ["mem","socket"]:
+		#closing one end, the other one has to report it (after the frames still buffered)
+		serial.sendLine(a,frames[0],size,0)
+		serial.closeLine(a)
+		buffrx=create_string_buffer(serial.getMaxLen())
+		startt=time.monotonic()
+		waited=serial.waitLine(b,c_float(1))
+		first=serial.receiveLine(b,buffrx,len(buffrx),None,None)
+		then=serial.receiveLine(b,buffrx,len(buffrx),None,None)
+		dt=time.monotonic()-startt
+		closedSeen=first==size and then==-1 and serial.waitLine(b,c_float(1))==-1
+		print("{0:<8} close:  other end {1} in {2:6.3f} s (wait {3}, receive {4} then {5})".format(transport,"reported closed" if closedSeen else "NOT reported closed",dt,waited,first,then))
+		testPass=testPass and closedSeen and dt<0.5
+	else:
+		serial.closeLine(a)
+	serial.closeLine(b)
+	return testPass
+
+print("Frames of {0} bytes".format(size))
+testPass=True
+transports=[t for t in args.transports.split(",") if t]
+if args.uart:
+	transports.append("uart")
+for transport in transports:
+	testPass=measure(transport) and testPass
+
+if testPass:
+	print("\nTEST SUCCESSFULL.")
+else:
+	print("\nTEST FAILED.")
+	sys.exit(1)
@@ -0,0 +1,412 @@
+#!/bin/python3
+
+#ADCS simulator, used to load-test and soak-test the daemon without
+#flight hardware.
+
+#It creates a pseudo-terminal and speaks the simpleDataLink protocol on
+#its master side (using the same serialInterface.so library of the daemon),
+#generating attitudeADCS, housekeepingADCS and opmodeADCS frames at the
+#requested rates and acking the commands it receives.
+#Unless --no-daemon is passed it also starts CDHdaemon.py with its UART on
+#the pty slave, a fake SMBus for the ADC, its own client socket and a
+#fake telegraf socket owned by the simulator, then periodically reports
+#sustained throughput, daemon memory (RSS) growth and frame loss.
+#With --transport mem or socket the board (boardSim.py) runs inside the
+#daemon on the peer end of an in-process transport instead, so the
+#protocol stack is measured without pty and relay overhead (the
+#--ack-*, --burst-* and --frame-loss options need the pty).
+
+#Examples:
+#	./simADCS.py --duration 3600 --attitude-rate 50 --housekeeping-rate 5
+#	./simADCS.py --duration 86400 --report-period 600 --max-rss-trend 50 (24 h soak test)
+#	./simADCS.py --no-daemon (then point CDH_UART_DEV of a daemon to the printed pty)
+#	./simADCS.py --transport mem --attitude-rate 1000 --duration 60
+
+import argparse
+import ctypes
+import math
+import os
+import random
+import select
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+scriptDir=os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(scriptDir,"messages"))
+import schemaLoader
+import boardSim
+
+serialLibPath=os.path.join(scriptDir,"serial","serialInterface.so")
+schemaPath=os.path.join(scriptDir,"messages","messages.json")
+
+burstGap=0.005 #silence (s) that closes a burst of bytes coming from the daemon
+drainTime=2 #time (s) waited at the end for frames still in flight
+daemonStartTimeout=30 #maximum time (s) waited for the daemon to answer on its client socket
+
+#parsing command line ---------------------------
+parser=argparse.ArgumentParser(description="PTY-backed ADCS simulator")
+parser.add_argument("--attitude-rate",type=float,default=10,help="attitudeADCS frames per second")
+parser.add_argument("--housekeeping-rate",type=float,default=1,help="housekeepingADCS frames per second")
+parser.add_argument("--opmode-rate",type=float,default=0.2,help="opmodeADCS frames per second")
+parser.add_argument("--burst-size",type=int,default=0,help="extra attitudeADCS frames sent back to back at every burst")
+parser.add_argument("--burst-period",type=float,default=10,help="time between bursts (s)")
+parser.add_argument("--ack-delay",type=float,default=0,help="delay (s) applied to every command coming from the daemon")
+parser.add_argument("--ack-loss",type=float,default=0,help="probability of losing a command (so it's not acked)")
+parser.add_argument("--command-period",type=float,default=0,help="send a setOpmodeADCS through the daemon client socket every period (s), 0 disabled")
+parser.add_argument("--duration",type=float,default=0,help="test duration (s), 0 runs until interrupted")
+parser.add_argument("--report-period",type=float,default=60,help="time between reports (s)")
+parser.add_argument("--deadband",action="store_true",help="keep deadband filtering enabled in the daemon (lines suppressed by it are not counted as lost)")
+parser.add_argument("--no-daemon",action="store_true",help="only create the pty and generate frames")
+parser.add_argument("--daemon-log",default=None,help="daemon output file (default in the temporary directory)")
+parser.add_argument("--frame-loss",type=float,default=0,help="probability of skipping a telemetry frame at the source (to check the daemon loss accounting)")
+parser.add_argument("--line-seq",action="store_true",help="make the daemon number its lines (CDH_LINE_SEQ) and count the missing sequence numbers")
+parser.add_argument("--max-rss-trend",type=float,default=0,help="soak test: fail if the daemon RSS trend after the warm-up is above this (kB/h), 0 disabled")
+parser.add_argument("--rss-warmup",type=float,default=600,help="time (s) excluded from the RSS trend check (buffers and caches filling up)")
+parser.add_argument("--uart-timeout",type=float,default=0.1,help="simulator side ack timeout (s)")
+parser.add_argument("--transport",choices=["pty","mem","socket"],default="pty",help="pty between simulator and daemon, or board simulated inside the daemon on a memory pipe or socket pair")
+args=None #parsed by main, so the helpers can be imported by other scripts
+#------------------------------------------------
+
+#relay between the pty master and the simulator serial line, it lets
+#the simulator delay or lose what the daemon sends (commands), a
+#command is a burst of bytes closed by burstGap of silence
+class ptyRelay(threading.Thread):
+	def __init__(self,master,sock,ackDelay,ackLoss):
+		super().__init__(daemon=True)
+		self.master=master
+		self.sock=sock
+		self.ackDelay=ackDelay
+		self.ackLoss=ackLoss
+		self.stop=threading.Event()
+		self.bursts=0
+		self.burstsLost=0
+		self.bytesIn=0
+		self.bytesOut=0
+
+	def run(self):
+		pending=bytearray() #bytes of the burst being received from the daemon
+		lastIn=0
+		delayed=[] #(due time, burst) waiting for ackDelay
+
+		while not self.stop.is_set():
+			now=time.monotonic()
+			timeout=0.1
+			if pending:
+				timeout=min(timeout,max(0,lastIn+burstGap-now))
+			if delayed:
+				timeout=min(timeout,max(0,delayed[0][0]-now))
+
+			r,_,_=select.select([self.master,self.sock],[],[],timeout)
+			now=time.monotonic()
+
+			if self.master in r:
+				try:
+					data=os.read(self.master,4096)
+				except OSError: #slave not opened yet
+					data=b""
+				pending+=data
+				lastIn=now
+				self.bytesIn+=len(data)
+
+			if self.sock in r:
+				data=self.sock.recv(4096)
+				self.bytesOut+=len(data)
+				while data:
+					written=os.write(self.master,data)
+					data=data[written:]
+
+			#closing the burst
+			if pending and now-lastIn>=burstGap:
+				self.bursts+=1
+				if random.random()<self.ackLoss:
+					self.burstsLost+=1
+				else:
+					delayed.append((now+self.ackDelay,bytes(pending)))
+				pending.clear()
+
+			while delayed and delayed[0][0]<=now:
+				self.sock.sendall(delayed.pop(0)[1])
+
+#fake telegraf, counts lines and bytes received from the daemon
+class telegrafSink(threading.Thread):
+	def __init__(self,path):
+		super().__init__(daemon=True)
+		self.sock=socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+		self.sock.bind(path)
+		self.sock.settimeout(0.2)
+		self.lines={} #measurement -> lines received
+		self.bytes=0
+		self.lastSeq=0 #last cdhSeq received (--line-seq)
+		self.seqMissing=0
+		self.stop=threading.Event()
+
+	def run(self):
+		while not self.stop.is_set():
+			try:
+				data=self.sock.recv(65536)
+			except socket.timeout:
+				continue
+			self.bytes+=len(data)
+			for line in data.split(b"\n"):
+				if line:
+					name=line.split(b",",1)[0].decode("utf-8","replace")
+					self.lines[name]=self.lines.get(name,0)+1
+					seqStart=line.find(b",cdhSeq=")
+					if seqStart>=0:
+						seq=int(line[seqStart+8:line.index(b"i",seqStart+8)])
+						if seq>self.lastSeq+1:
+							self.seqMissing+=seq-self.lastSeq-1
+						self.lastSeq=max(self.lastSeq,seq)
+
+#sends a command string to the daemon client socket and returns the answer
+def daemonRequest(sockPath,cmd,timeout=2):
+	client=socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+	client.bind("")
+	client.settimeout(timeout)
+	try:
+		client.sendto(cmd.encode("utf-8"),sockPath)
+		data,addr=client.recvfrom(65536)
+		return data.decode("utf-8")
+	except:
+		return None
+	finally:
+		client.close()
+
+#sends commands through the daemon client socket (in its own thread, as the
+#simulator loop must keep running to ack them)
+class commandSender(threading.Thread):
+	def __init__(self,sockPath,period):
+		super().__init__(daemon=True)
+		self.sockPath=sockPath
+		self.period=period
+		self.ok=0
+		self.failed=0
+		self.stop=threading.Event()
+
+	def run(self):
+		while not self.stop.wait(self.period):
+			answer=daemonRequest(self.sockPath,"setOpmodeADCS {0}".format(random.randint(0,3)))
+			if answer and not answer.startswith("ERROR"):
+				self.ok+=1
+			else:
+				self.failed+=1
+
+#reads the resident memory (kB) of a process
+def readRSS(pid):
+	try:
+		with open("/proc/{0}/status".format(pid)) as f:
+			for line in f:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1])
+	except:
+		pass
+	return None
+
+#least squares slope of (x,y) samples
+def slope(samples):
+	n=len(samples)
+	if n<2:
+		return 0
+	mx=sum(x for x,_ in samples)/n
+	my=sum(y for _,y in samples)/n
+	den=sum((x-mx)**2 for x,_ in samples)
+	return sum((x-mx)*(y-my) for x,y in samples)/den if den else 0
+
+#parses the daemon statistics text
+def parseStats(text):
+	stats={}
+	for line in (text or "").split("\n"):
+		key,_,value=line.partition(": ")
+		try:
+			stats[key]=float(value)
+		except ValueError:
+			pass
+	return stats
+
+def main():
+	global args
+	args=parser.parse_args()
+
+	tmpDir=tempfile.mkdtemp(prefix="simADCS_")
+	cdhSock=os.path.join(tmpDir,"CDH.sock")
+	telegrafSock=os.path.join(tmpDir,"telegraf.sock")
+
+	msg,_=schemaLoader.loadSchema(schemaPath)
+	rates={"attitudeADCS":args.attitude_rate,"housekeepingADCS":args.housekeeping_rate,"opmodeADCS":args.opmode_rate}
+	inDaemon=args.transport!="pty" #board simulated by the daemon
+
+	if inDaemon and args.no_daemon:
+		print("ERROR: --transport {0} runs the board inside the daemon, it can't be used with --no-daemon".format(args.transport))
+		return
+
+	serial=None
+	relay=None
+	sim=None
+	if not inDaemon:
+		#creating the pty, the slave is kept open so the master never sees a hang up
+		master,slave=os.openpty()
+		tty.setraw(slave)
+		slaveName=os.ttyname(slave)
+		print("ADCS pty: {0}".format(slaveName))
+
+		#simulator serial line runs on a socket relayed to the pty master
+		libSock,relaySock=socket.socketpair()
+		relay=ptyRelay(master,relaySock,args.ack_delay,args.ack_loss)
+		relay.start()
+
+		serial=ctypes.CDLL(serialLibPath)
+		simLine=serial.openLineFd(libSock.fileno(),ctypes.c_float(args.uart_timeout),ctypes.c_uint8(0))
+
+	sink=None
+	daemon=None
+	if not args.no_daemon:
+		sink=telegrafSink(telegrafSock)
+		sink.start()
+
+		env=dict(os.environ)
+		if inDaemon:
+			env["CDH_TRANSPORT"]=args.transport
+			env["CDH_SIM_RATES"]=",".join("{0}={1}".format(name,rate) for name,rate in rates.items())
+		else:
+			env["CDH_UART_DEV"]=slaveName
+		env["CDH_SOCK"]=cdhSock
+		env["CDH_TELEGRAF_SOCK"]=telegrafSock
+		env["CDH_FAKE_SMBUS"]="1"
+		env["CDH_SCHED_FILE"]=os.path.join(tmpDir,"scheduledCommands.json")
+		env["CDH_DEADBAND"]="1" if args.deadband else "0"
+		env["CDH_LINE_SEQ"]="1" if args.line_seq else "0"
+		logPath=args.daemon_log or os.path.join(tmpDir,"daemon.log")
+		logFile=open(logPath,"w")
+		daemon=subprocess.Popen([sys.executable,"CDHdaemon.py"],cwd=scriptDir,env=env,stdout=logFile,stderr=subprocess.STDOUT)
+		print("Started daemon (pid {0}), log in {1}".format(daemon.pid,logPath))
+
+		#waiting for the daemon to be up, frames sent before it opens the
+		#pty would be flushed and counted as lost
+		waitStart=time.monotonic()
+		while daemonRequest(cdhSock,"stats",timeout=0.5) is None:
+			if daemon.poll() is not None or time.monotonic()-waitStart>daemonStartTimeout:
+				print("ERROR: daemon didn't start, see {0}".format(logPath))
+				if relay:
+					relay.stop.set()
+				return
+		print("Daemon ready after {0:.2f} s".format(time.monotonic()-waitStart))
+
+	startt=time.monotonic()
+	if not inDaemon:
+		sim=boardSim.BoardSimulator(serial,simLine,msg,rates,args.frame_loss,args.burst_size,args.burst_period)
+	commands=None
+	if args.command_period>0 and daemon:
+		commands=commandSender(cdhSock,args.command_period)
+		commands.start()
+	nextReport=startt+args.report_period
+	endt=startt+args.duration if args.duration>0 else math.inf
+
+	rssSamples=[] #(hours, kB)
+	lastReport=(startt,0,0,0) #(time, frames sent, lines received, bytes received)
+
+	def report(final=False):
+		nonlocal lastReport
+		now=time.monotonic()
+		stats=parseStats(daemonRequest(cdhSock,"stats")) if daemon else {}
+		#frames sent by the board (counted by the daemon when it runs the board)
+		if sim:
+			sentBy={name:g.sent for name,g in sim.generators.items()}
+			skipped=sum(g.skipped for g in sim.generators.values())
+		else:
+			sentBy={name:int(stats.get("simFrames"+name[0].upper()+name[1:],0)) for name in rates}
+			skipped=int(stats.get("simFramesSkipped",0))
+		sent=sum(sentBy.values())
+		received=sum(sink.lines.values()) if sink else 0
+		rxBytes=sink.bytes if sink else 0
+		dt=now-lastReport[0]
+
+		print("--- {0} report after {1:.0f} s ---".format("FINAL" if final else "SIM",now-startt))
+		print("frames sent: {0} ({1:.1f}/s) {2}".format(sent,(sent-lastReport[1])/dt,sentBy))
+		if relay:
+			print("commands from daemon: {0} bursts {1} lost by relay, received {2}".format(relay.bursts,relay.burstsLost,sim.commandsIn))
+		else:
+			print("commands from daemon: {0:.0f} received by the {1} board".format(stats.get("simCommandsIn",0),args.transport))
+		if commands:
+			print("commands through client socket: {0} acked, {1} failed".format(commands.ok,commands.failed))
+
+		if sink:
+			print("lines received: {0} ({1:.1f}/s, {2:.0f} B/s) {3}".format(received,(received-lastReport[2])/dt,(rxBytes-lastReport[3])/dt,sink.lines))
+			#attitudeADCS and housekeepingADCS always produce a line (ticktime changes)
+			#unless their fields are suppressed by the deadband
+			for name in ["attitudeADCS","housekeepingADCS"]:
+				lost=sentBy[name]-sink.lines.get(name,0)
+				print("{0} frames lost: {1} ({2:.3f}%){3}".format(name,lost,100*lost/max(1,sentBy[name]),"" if final else " (including frames in flight)"))
+			if args.line_seq:
+				print("line sequence numbers missing: {0} (last {1})".format(sink.seqMissing,sink.lastSeq))
+			if stats:
+				if args.deadband:
+					print("daemon deadband: "+" ".join("{0}: {1:.0f}".format(k,v) for k,v in stats.items() if k.startswith("deadbandLines")))
+				print("frames skipped at the source: {0}, daemon loss accounting: {1}".format(skipped," ".join("{0}: {1:g}".format(k,v) for k,v in stats.items() if k.startswith("loss"))))
+
+		if daemon:
+			rss=readRSS(daemon.pid)
+			if rss is not None:
+				rssSamples.append(((now-startt)/3600,rss))
+				print("daemon RSS: {0} kB, growth {1} kB since first sample, trend {2:.1f} kB/h".format(rss,rss-rssSamples[0][1],slope(rssSamples)))
+			if daemon.poll() is not None:
+				print("ERROR: daemon exited with code {0}".format(daemon.returncode))
+
+		lastReport=(now,sent,received,rxBytes)
+
+	try:
+		while time.monotonic()<endt:
+			#the board runs here until the next report (or inside the daemon)
+			until=min(nextReport,endt)
+			if sim:
+				sim.run(until)
+			else:
+				time.sleep(max(0,until-time.monotonic()))
+
+			if time.monotonic()>=nextReport:
+				nextReport+=args.report_period
+				report()
+	except KeyboardInterrupt:
+		pass
+
+	if commands:
+		commands.stop.set()
+	if sink:
+		time.sleep(drainTime)
+	report(final=True)
+
+	soakPass=True
+	if daemon and daemon.poll() is None:
+		memReport=daemonRequest(cdhSock,"mem")
+		if memReport:
+			print("daemon memory report:\n"+memReport,end="")
+	if args.max_rss_trend>0:
+		steady=[sample for sample in rssSamples if sample[0]>=args.rss_warmup/3600]
+		if len(steady)<2:
+			print("SOAK TEST FAILED: not enough RSS samples after the warm-up (use a longer --duration or a shorter --report-period)")
+			soakPass=False
+		else:
+			trend=slope(steady)
+			soakPass=trend<=args.max_rss_trend
+			print("SOAK TEST {0}: RSS trend after the warm-up {1:.1f} kB/h (maximum {2:.1f} kB/h) over {3} samples".format("PASSED" if soakPass else "FAILED",trend,args.max_rss_trend,len(steady)))
+
+	if daemon:
+		daemon.terminate()
+		try:
+			daemon.wait(timeout=10)
+		except subprocess.TimeoutExpired:
+			daemon.kill()
+	if sink:
+		sink.stop.set()
+	if relay:
+		relay.stop.set()
+		serial.closeLine(sim.line)
+	if not soakPass:
+		sys.exit(1)
+
+if __name__=="__main__":
+	main()
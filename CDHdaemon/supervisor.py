@@ -0,0 +1,147 @@
+#Per-subsystem thread supervisor
+
+#Every subsystem runs in its own thread, receiving a worker handle it has
+#to use to send heartbeats (worker.beat()) and to know when to exit
+#(worker.stopping()). When a thread raises an exception the supervisor is
+#woken up immediately and restarts only that subsystem, when a thread
+#stops sending heartbeats it's retired (it will exit as soon as it
+#checks stopping()) and a new one is started in its place.
+#Consecutive failures are restarted with exponential backoff, everything
+#living outside the thread (queues, filters, statistics) is kept.
+
+import threading
+import time
+import traceback
+
+import diagLog
+
+#handle given to a subsystem thread
+class worker:
+	__slots__=("stopAll","retired","lastBeat","exited")
+
+	def __init__(self,stopAll):
+		self.stopAll=stopAll
+		self.retired=threading.Event()
+		self.lastBeat=time.monotonic()
+		self.exited=False #set by the wrapper when the thread function returns
+
+	def beat(self):
+		self.lastBeat=time.monotonic()
+
+	#true when the daemon is closing or this thread was replaced
+	def stopping(self):
+		return self.stopAll.is_set() or self.retired.is_set()
+
+class subsystem:
+	def __init__(self,name,target,heartbeatTimeout):
+		self.name=name
+		self.target=target
+		self.heartbeatTimeout=heartbeatTimeout
+		self.thread=None
+		self.worker=None
+		self.startTime=0
+		self.failTime=None #time of the failure not yet recovered
+		self.restartTime=0 #time of the next restart
+		self.failures=0 #consecutive failures (for backoff)
+		self.restarts=0
+		self.downtime=0 #total time (s) spent without a running thread
+		self.lastError=""
+
+class Supervisor:
+	def __init__(self,stopAll,backoffMin=0.01,backoffMax=30,stableTime=60):
+		self.stopAll=stopAll
+		self.backoffMin=backoffMin #delay before the first restart (s)
+		self.backoffMax=backoffMax #maximum delay between restarts (s)
+		self.stableTime=stableTime #running time after which failures are forgotten (s)
+		self.subsystems={}
+		self.wake=threading.Event() #set by a failing thread to wake up poll()
+		self.lock=threading.Lock()
+
+	#registers a subsystem, target is called as target(worker)
+	def add(self,name,target,heartbeatTimeout):
+		self.subsystems[name]=subsystem(name,target,heartbeatTimeout)
+
+	def start(self):
+		for s in self.subsystems.values():
+			self.startSubsystem(s)
+
+	def startSubsystem(self,s):
+		w=worker(self.stopAll)
+		s.worker=w
+		s.startTime=time.monotonic()
+		s.thread=threading.Thread(target=self.run,args=(s,w),name=s.name,daemon=True)
+		s.thread.start()
+
+	#thread wrapper, reports failures of the subsystem
+	def run(self,s,w):
+		try:
+			s.target(w)
+		except Exception:
+			diagLog.error("{0} thread crashed\n{1}",s.name,traceback.format_exc().rstrip())
+			error=traceback.format_exc().strip().split("\n")[-1]
+		else:
+			error="thread returned"
+		#a retired thread was already replaced, its failure is not reported
+		if s.worker is w and not w.stopping():
+			s.lastError=error
+			w.exited=True
+			self.wake.set()
+
+	def failed(self,s,now,reason):
+		if now-s.startTime>self.stableTime:
+			s.failures=0
+		s.failures+=1
+		s.failTime=now
+		s.restartTime=now+min(self.backoffMax,self.backoffMin*2**(s.failures-1))
+		diagLog.error("{0} subsystem failed ({1}), restarting in {2:.3f} s",s.name,reason,s.restartTime-now)
+
+	#checks heartbeats and restarts failed subsystems, returns the
+	#maximum time to wait before calling it again
+	def poll(self):
+		self.wake.clear()
+		timeout=0.1
+		if self.stopAll.is_set():
+			return timeout
+
+		with self.lock:
+			now=time.monotonic()
+			for s in self.subsystems.values():
+				if s.failTime is None:
+					if s.worker.exited or not s.thread.is_alive():
+						self.failed(s,now,s.lastError or "thread closed")
+					elif now-s.worker.lastBeat>s.heartbeatTimeout:
+						s.worker.retired.set() #the hung thread will close if it ever wakes up
+						s.lastError="no heartbeat for {0:.1f} s".format(now-s.worker.lastBeat)
+						self.failed(s,now,s.lastError)
+
+				if s.failTime is not None:
+					if now>=s.restartTime:
+						self.startSubsystem(s)
+						s.restarts+=1
+						s.downtime+=time.monotonic()-s.failTime
+						diagLog.info("{0} subsystem restarted ({1} restarts)",s.name,s.restarts)
+						s.failTime=None
+					else:
+						timeout=min(timeout,s.restartTime-now)
+		return timeout
+
+	#waits for a failure or for timeout seconds
+	def wait(self,timeout):
+		self.wake.wait(timeout)
+
+	#joins all threads, used on termination
+	def join(self,timeout):
+		for s in self.subsystems.values():
+			if s.thread:
+				s.thread.join(timeout=timeout)
+
+	def stats(self):
+		stats={}
+		now=time.monotonic()
+		with self.lock:
+			for s in self.subsystems.values():
+				down=s.downtime+(now-s.failTime if s.failTime is not None else 0)
+				stats[s.name+"Restarts"]=s.restarts
+				stats[s.name+"DowntimeMs"]=round(down*1000,3)
+				stats[s.name+"Running"]=int(s.failTime is None)
+		return stats
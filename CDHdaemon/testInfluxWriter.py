@@ -0,0 +1,138 @@
+#!/bin/python3
+
+#this test script checks the InfluxDB writer (influxWriter.py) against
+#a local stub of the /api/v2/write endpoint and compares its throughput
+#and CPU usage with the telegraf path (one unixgram datagram per line)
+
+#the stub checks the token and the gzip body, counts the lines and can
+#fail a fraction of the requests (--fail-rate) to exercise the retries
+
+import argparse
+import gzip
+import http.server
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import influxWriter
+
+parser=argparse.ArgumentParser(description="InfluxDB writer test and telegraf path comparison")
+parser.add_argument("--lines",type=int,default=200000,help="number of lines sent on each path")
+parser.add_argument("--fail-rate",type=float,default=0,help="fraction of write requests answered with 503")
+args=parser.parse_args()
+
+token="testToken"
+
+#stub InfluxDB server ------------------
+class stubState:
+	lines=0
+	requests=0
+	failed=0
+	bytes=0
+
+class stubHandler(http.server.BaseHTTPRequestHandler):
+	protocol_version="HTTP/1.1" #keep-alive
+
+	def do_POST(self):
+		body=self.rfile.read(int(self.headers["Content-Length"]))
+		stubState.requests+=1
+		if self.headers["Authorization"]!="Token "+token or not self.path.startswith("/api/v2/write?"):
+			self.answer(401)
+			return
+		if args.fail_rate and (stubState.requests%int(1/args.fail_rate))==0:
+			stubState.failed+=1
+			self.answer(503)
+			return
+		data=gzip.decompress(body) if self.headers["Content-Encoding"]=="gzip" else body
+		stubState.bytes+=len(body)
+		stubState.lines+=data.count(b"\n")
+		self.answer(204)
+
+	def answer(self,code):
+		self.send_response(code)
+		self.send_header("Content-Length","0")
+		self.end_headers()
+
+	def log_message(self,*args):
+		pass
+
+server=http.server.ThreadingHTTPServer(("127.0.0.1",0),stubHandler)
+threading.Thread(target=server.serve_forever,daemon=True).start()
+url="http://127.0.0.1:{0}".format(server.server_address[1])
+#---------------------------------------
+
+line="housekeepingADCS,source=ADCS code=22i,temperature[0]=24.5,temperature[1]=24.75,temperatureRAW[0]=2450i,ticktime=123456i {0}\n"
+testPass=True
+
+print("Testing InfluxDB writer against {0} with {1} lines".format(url,args.lines))
+writer=influxWriter.InfluxWriter(url,token,"starlab","dlab",batchTime=0.1,retryMin=0.01)
+startt=time.perf_counter()
+startcpu=time.thread_time()
+for i in range(args.lines):
+	writer.write(line.format(i).encode("utf-8"),None)
+	writer.poll()
+while writer.pendingLines or writer.lines:
+	writer.flush()
+influxTime=time.perf_counter()-startt
+influxCpu=time.thread_time()-startcpu
+writer.close()
+print(writer.stats())
+
+if stubState.lines!=args.lines:
+	print("ERROR: the stub received {0} lines instead of {1}".format(stubState.lines,args.lines))
+	testPass=False
+
+#backlog left by an outage: it must be drained one batch per poll, so the
+#log thread can beat its heartbeat between requests
+print("Testing backlog drain")
+writer=influxWriter.InfluxWriter(url,token,"starlab","dlab",batchLines=1000)
+for i in range(20000):
+	writer.write(line.format(i).encode("utf-8"),None)
+polls=0
+while writer.pending:
+	sent=writer.batchesSent
+	writer.poll()
+	polls+=1
+	if writer.batchesSent-sent>1:
+		print("ERROR: {0} batches sent by a single poll".format(writer.batchesSent-sent))
+		testPass=False
+		break
+writer.close()
+print("{0} batches sent in {1} polls".format(writer.batchesSent,polls))
+
+print("Testing telegraf path (unixgram socket) with {0} lines".format(args.lines))
+sockPath=os.path.join(tempfile.mkdtemp(),"telegraf.sock")
+receiver=socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+receiver.bind(sockPath)
+received=[0]
+def receive():
+	while 1:
+		receiver.recv(4096)
+		received[0]+=1
+threading.Thread(target=receive,daemon=True).start()
+
+sender=socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+sender.connect(sockPath)
+startt=time.perf_counter()
+startcpu=time.thread_time()
+for i in range(args.lines):
+	sender.send(line.format(i).encode("utf-8"))
+telegrafTime=time.perf_counter()-startt
+telegrafCpu=time.thread_time()-startcpu
+sender.close()
+
+print("")
+print("path      lines/s    CPU us/line")
+print("influx  {0:9.0f}  {1:9.2f}  ({2} requests, {3:.1f} B/line on the wire)".format(args.lines/influxTime,influxCpu/args.lines*1e6,stubState.requests,stubState.bytes/max(1,stubState.lines)))
+print("telegraf{0:9.0f}  {1:9.2f}  (one datagram per line, then telegraf has to batch them again)".format(args.lines/telegrafTime,telegrafCpu/args.lines*1e6))
+
+server.shutdown()
+
+if testPass:
+	print("\nTEST SUCCESSFULL.")
+else:
+	print("\nTEST FAILED.")
+	sys.exit(1)
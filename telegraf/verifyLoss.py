@@ -0,0 +1,192 @@
+#!/bin/python3
+
+#End-to-end telemetry loss verifier
+
+#Reads the lines written by CDHdaemon (started with CDH_LINE_SEQ=1, so
+#every line carries the cdhSeq sequence field) either binding the
+#telegraf socket in place of telegraf (--bind) or from a line protocol
+#file (--file, e.g. the daemon log file or a telegraf file output), and
+#counts the missing lines per stage:
+#	source:    ticktime gaps of every measurement/source series (frames
+#	           lost by the ADCS, on the UART or by the serial library)
+#	daemon:    lines dropped by the daemon before reaching the sink
+#	           (telegraf not connected, InfluxDB writer buffer full),
+#	           read from the daemon statistics (--daemon-sock)
+#	transport: missing sequence numbers not dropped by the daemon (lost
+#	           by the unixgram socket, telegraf or later)
+#The sequence restarts with the daemon, every restart starts a new run.
+#Lines suppressed by the daemon deadband (on by default) don't reach the
+#sink, tick field included, so they look like ticktime gaps: the lines
+#suppressed per measurement are read from the daemon statistics and
+#subtracted from the gaps of that measurement. The daemon counters cover
+#its whole run, so the subtraction is exact only when the verifier sees
+#the whole run too (and the period estimate of a measurement whose lines
+#are mostly suppressed is unreliable): the source loss counted by the
+#daemon itself, before the deadband, is the reference.
+
+#Examples:
+#	sudo systemctl stop telegraf; ./verifyLoss.py --bind /tmp/telegraf.sock --duration 600
+#	./verifyLoss.py --file ../CDHdaemon/telegrafLog.txt --daemon-sock /tmp/CDH.sock
+
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","CDHdaemon"))
+import lossTracker
+
+parser=argparse.ArgumentParser(description="CDHdaemon telemetry loss verifier")
+source=parser.add_mutually_exclusive_group(required=True)
+source.add_argument("--bind",help="unixgram socket path to bind in place of telegraf")
+source.add_argument("--file",help="line protocol file to read")
+parser.add_argument("--daemon-sock",default="/tmp/CDH.sock",help="daemon client socket, used to read its loss statistics (empty to skip)")
+parser.add_argument("--seq-field",default="cdhSeq",help="sequence field added by the daemon")
+parser.add_argument("--tick-field",default="ticktime",help="tick counter field of the telemetry messages")
+parser.add_argument("--duration",type=float,default=0,help="time (s) to listen with --bind, 0 runs until interrupted")
+parser.add_argument("--report-period",type=float,default=60,help="time between reports with --bind (s)")
+parser.add_argument("--reorder-window",type=int,default=1000,help="a sequence going back more than this starts a new run (daemon restart)")
+args=parser.parse_args()
+
+#sequence numbers of a daemon run
+class seqRun:
+	def __init__(self,seq):
+		self.first=seq
+		self.last=seq
+		self.lines=0
+
+	def missing(self):
+		return self.last-self.first+1-self.lines
+
+runs=[]
+ticks=lossTracker.LossTracker(args.tick_field)
+lines={} #measurement -> lines received
+noSeq=0 #lines without sequence field
+
+#parses a line protocol line and updates the counters
+def checkLine(line):
+	global noSeq
+	try:
+		series,fields,timestamp=line.rsplit(" ",2)
+	except ValueError:
+		return
+	tags=series.split(",")
+	name=tags[0]
+	lines[name]=lines.get(name,0)+1
+
+	seq=None
+	tick=None
+	for field in fields.split(","):
+		key,_,value=field.partition("=")
+		if key==args.seq_field:
+			seq=int(value.rstrip("i"))
+		elif key==args.tick_field:
+			tick=int(value.rstrip("i"))
+
+	if tick is not None:
+		ticks.tick((name,",".join(tags[1:])),tick)
+
+	if seq is None:
+		noSeq+=1
+		return
+	if not runs or seq<runs[-1].last-args.reorder_window:
+		runs.append(seqRun(seq))
+	run=runs[-1]
+	run.first=min(run.first,seq)
+	run.last=max(run.last,seq)
+	run.lines+=1
+
+#reads the loss statistics of the daemon
+def daemonStats():
+	if not args.daemon_sock:
+		return None
+	client=socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+	client.bind("")
+	client.settimeout(2)
+	try:
+		client.sendto(b"stats",args.daemon_sock)
+		data,addr=client.recvfrom(65536)
+	except:
+		return None
+	finally:
+		client.close()
+	stats={}
+	for line in data.decode("utf-8").split("\n"):
+		key,_,value=line.partition(": ")
+		try:
+			stats[key]=float(value)
+		except ValueError:
+			pass
+	return stats
+
+def report(final=False):
+	print("--- {0} ---".format("FINAL report" if final else time.strftime("%Y-%m-%d %H:%M:%S")))
+	print("lines received: {0} {1}".format(sum(lines.values()),lines))
+
+	stats=daemonStats()
+	tickStats=ticks.stats()
+	print("source:    {0} frames missing out of {1} ({2:.4f}%), {3} source restarts (ticktime gaps seen by the verifier, include losses of all stages)".format(tickStats["lossSourceFramesMissing"],tickStats["lossSourceFramesMissing"]+tickStats["lossSourceFramesIn"],100*tickStats["lossSourceRatio"],tickStats["lossSourceResets"]))
+
+	dropped=None
+	if stats:
+		#gaps left by the lines suppressed by the deadband, per measurement
+		missingByName={}
+		for (name,_),missing in ticks.missingBySeries.items():
+			missingByName[name]=missingByName.get(name,0)+missing
+		suppressed=sum(min(missing,stats.get("deadbandLinesSuppressed"+name[0].upper()+name[1:],0)) for name,missing in missingByName.items())
+		if suppressed:
+			print("           {0:.0f} of them are lines suppressed by the daemon deadband, {1:.0f} frames left missing (approximate, see below)".format(suppressed,tickStats["lossSourceFramesMissing"]-suppressed))
+		print("           {0:.0f} frames missing seen by the daemon before the deadband ({1:.4f}%, the reference for source loss)".format(stats.get("lossSourceFramesMissing",0),100*stats.get("lossSourceRatio",0)))
+		dropped=stats.get("lossLinesDropped",0)+stats.get("influxLinesDropped",0)
+		print("daemon:    {0:.0f} lines dropped out of {1:.0f} ({2:.0f} with telegraf not connected or failing, {3:.0f} by the InfluxDB writer)".format(dropped,stats.get("lossLinesOut",0),stats.get("lossLinesDropped",0),stats.get("influxLinesDropped",0)))
+	elif args.daemon_sock:
+		print("daemon:    statistics not available ({0} not answering)".format(args.daemon_sock))
+
+	if not runs:
+		print("transport: no line with the {0} field (start the daemon with CDH_LINE_SEQ=1)".format(args.seq_field))
+		return
+	missing=sum(run.missing() for run in runs)
+	expected=sum(run.last-run.first+1 for run in runs)
+	print("sequence:  {0} lines missing out of {1} ({2:.4f}%) in {3} daemon runs, {4} lines without sequence".format(missing,expected,100*missing/max(1,expected),len(runs),noSeq))
+	if dropped is not None:
+		#the daemon counters cover only its current run
+		print("transport: {0:.0f} lines lost after the daemon (missing sequences of the last run minus lines dropped by the daemon)".format(runs[-1].missing()-dropped))
+	if not final:
+		print("           (lines still in flight are counted as missing)")
+
+if args.file:
+	with open(args.file,"r",errors="replace") as f:
+		for line in f:
+			checkLine(line.strip())
+	report(final=True)
+	sys.exit()
+
+if os.path.exists(args.bind):
+	os.remove(args.bind)
+sock=socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+sock.bind(args.bind)
+sock.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,4*1024*1024)
+sock.settimeout(0.2)
+print("Listening on {0}".format(args.bind))
+
+startt=time.monotonic()
+nextReport=startt+args.report_period
+try:
+	while args.duration<=0 or time.monotonic()-startt<args.duration:
+		try:
+			data=sock.recv(65536)
+		except socket.timeout:
+			data=b""
+		for line in data.decode("utf-8","replace").split("\n"):
+			if line:
+				checkLine(line)
+		if time.monotonic()>=nextReport:
+			nextReport+=args.report_period
+			report()
+except KeyboardInterrupt:
+	pass
+
+report(final=True)
+sock.close()
+os.remove(args.bind)